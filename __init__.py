@@ -11,10 +11,12 @@ from .move import *
 from .move_template import *
 from .tax import *
 from .party import *
+from .sequence import *
 
 
 def register():
     Pool.register(
+        Sequence,
         FiscalYear,
         BalanceNonDeferralStart,
         TypeTemplate,
@@ -45,12 +47,16 @@ def register():
         Journal,
         JournalSequence,
         JournalAccount,
+        JournalDailyTotal,
         JournalCashContext,
         JournalPeriod,
         Move,
         Reconciliation,
         ConfigurationTaxRounding,
         Line,
+        AccountPeriodBalance,
+        LineOpenItem,
+        LineReconcilePair,
         OpenJournalAsk,
         ReconcileLinesWriteOff,
         ReconcileShow,
@@ -77,6 +83,7 @@ def register():
         CreateMoveKeywords,
         Party,
         PartyAccount,
+        PartyBalance,
         RenewFiscalYearStart,
         module='account', type_='model')
     Pool.register(
@@ -2,11 +2,13 @@
 # this repository contains the full copyright notices and license terms.
 from decimal import Decimal
 import datetime
-import operator
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 from functools import wraps
+from weakref import WeakKeyDictionary
 
 from dateutil.relativedelta import relativedelta
-from sql import Column, Null, Window, Literal
+from sql import Column, Null, Window, Literal, Union, Cast, Values
 from sql.aggregate import Sum, Max
 from sql.conditionals import Coalesce, Case
 
@@ -22,7 +24,7 @@ from trytond import backend
 
 __all__ = ['TypeTemplate', 'Type',
     'AccountTemplate', 'AccountTemplateTaxTemplate',
-    'Account', 'AccountDeferral', 'AccountTax',
+    'Account', 'AccountDeferral', 'AccountPeriodBalance', 'AccountTax',
     'OpenChartAccountStart', 'OpenChartAccount',
     'GeneralLedgerAccount', 'GeneralLedgerAccountContext',
     'GeneralLedgerLine', 'GeneralLedgerLineContext',
@@ -209,7 +211,6 @@ class Type(sequence_ordered(), ModelSQL, ModelView):
     @classmethod
     def get_amount(cls, types, name):
         pool = Pool()
-        Account = pool.get('account.account')
         GeneralLedger = pool.get('account.general_ledger.account')
 
         res = {}
@@ -219,9 +220,10 @@ class Type(sequence_ordered(), ModelSQL, ModelView):
         childs = cls.search([
                 ('parent', 'child_of', [t.id for t in types]),
                 ])
-        type_sum = {}
+        children = defaultdict(list)
         for type_ in childs:
-            type_sum[type_.id] = Decimal('0.0')
+            if type_.parent:
+                children[type_.parent.id].append(type_.id)
 
         start_period_ids = GeneralLedger.get_period_ids('start_%s' % name)
         end_period_ids = GeneralLedger.get_period_ids('end_%s' % name)
@@ -229,24 +231,91 @@ class Type(sequence_ordered(), ModelSQL, ModelView):
             set(end_period_ids).difference(set(start_period_ids)))
 
         with Transaction().set_context(periods=period_ids):
-            accounts = Account.search([
-                    ('type', 'in', [t.id for t in childs]),
-                    ('kind', '!=', 'view'),
-                    ])
-        for account in accounts:
-            type_sum[account.type.id] += (account.debit - account.credit)
+            type_sum = cls.get_balance_by_type([t.id for t in childs])
+
+        # Propagate the sums from the leaves to the roots
+        totals = {}
+
+        def total(type_id):
+            if type_id not in totals:
+                totals[type_id] = type_sum[type_id] + sum(
+                    (total(c) for c in children[type_id]), Decimal('0.0'))
+            return totals[type_id]
 
         for type_ in types:
-            childs = cls.search([
-                    ('parent', 'child_of', [type_.id]),
-                    ])
-            for child in childs:
-                res[type_.id] += type_sum[child.id]
-            res[type_.id] = type_.company.currency.round(res[type_.id])
+            res[type_.id] = type_.company.currency.round(total(type_.id))
             if type_.display_balance == 'credit-debit':
                 res[type_.id] = - res[type_.id]
         return res
 
+    @classmethod
+    def get_balance_by_type(cls, ids):
+        '''
+        Return the debit - credit of the non-view accounts grouped by type.
+        If cumulate is set in the context, the previous fiscal years are
+        added.
+        '''
+        pool = Pool()
+        Account = pool.get('account.account')
+        Deferral = pool.get('account.account.deferral')
+        FiscalYear = pool.get('account.fiscalyear')
+        MoveLine = pool.get('account.move.line')
+        PeriodBalance = pool.get('account.account.period_balance')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        account = Account.__table__()
+        line = MoveLine.__table__()
+        period_balance = PeriodBalance.__table__()
+        deferral = Deferral.__table__()
+        line_query, fiscalyear_ids = MoveLine.query_get(line)
+        source, source_query = line, line_query
+        period_balance_query = PeriodBalance.query_get(period_balance)
+        if period_balance_query is not None:
+            source, source_query = period_balance, period_balance_query
+
+        result = defaultdict(Decimal)
+
+        def add(query):
+            cursor.execute(*query)
+            for type_id, value in cursor.fetchall():
+                # SQLite uses float for SUM
+                if not isinstance(value, Decimal):
+                    value = Decimal(str(value))
+                result[type_id] += value
+
+        where = (account.kind != 'view') & (account.active == True)
+        for sub_ids in grouped_slice(ids):
+            add(account.join(source, condition=source.account == account.id
+                    ).select(account.type,
+                    Sum(Coalesce(source.debit, 0)
+                        - Coalesce(source.credit, 0)),
+                    where=reduce_ids(account.type, sub_ids) & where
+                    & source_query,
+                    group_by=account.type))
+
+        if transaction.context.get('cumulate') and fiscalyear_ids:
+            fiscalyear = min(FiscalYear.browse(fiscalyear_ids),
+                key=lambda f: f.start_date)
+            periods, closed_fiscalyear = Account.get_previous_fiscalyears(
+                fiscalyear)
+            if periods:
+                with transaction.set_context(fiscalyear=None, date=None,
+                        periods=[p.id for p in periods], cumulate=False):
+                    for type_id, value in cls.get_balance_by_type(
+                            ids).iteritems():
+                        result[type_id] += value
+            if closed_fiscalyear:
+                for sub_ids in grouped_slice(ids):
+                    add(account.join(deferral,
+                            condition=deferral.account == account.id
+                            ).select(account.type,
+                            Sum(deferral.debit - deferral.credit),
+                            where=reduce_ids(account.type, sub_ids) & where
+                            & (deferral.fiscalyear == closed_fiscalyear.id),
+                            group_by=account.type))
+        return result
+
     @classmethod
     def get_amount_cmp(cls, types, name):
         transaction = Transaction()
@@ -623,6 +692,7 @@ class Account(ModelSQL, ModelView):
                 'for journal types: "expense" and "revenue"'),
             depends=['company'])
     template = fields.Many2One('account.account.template', 'Template')
+    _opening_cache = WeakKeyDictionary()
 
     @classmethod
     def __setup__(cls):
@@ -708,33 +778,53 @@ class Account(ModelSQL, ModelView):
         pool = Pool()
         MoveLine = pool.get('account.move.line')
         FiscalYear = pool.get('account.fiscalyear')
+        PeriodBalance = pool.get('account.account.period_balance')
         cursor = Transaction().connection.cursor()
 
         table_a = cls.__table__()
         table_c = cls.__table__()
         line = MoveLine.__table__()
+        period_balance = PeriodBalance.__table__()
         ids = [a.id for a in accounts]
         balances = dict((i, 0) for i in ids)
         line_query, fiscalyear_ids = MoveLine.query_get(line)
+        source, source_query = line, line_query
+        period_balance_query = PeriodBalance.query_get(period_balance)
+        if period_balance_query is not None:
+            source, source_query = period_balance, period_balance_query
         for sub_ids in grouped_slice(ids):
             red_sql = reduce_ids(table_a.id, sub_ids)
-            cursor.execute(*table_a.join(table_c,
-                    condition=(table_c.left >= table_a.left)
-                    & (table_c.right <= table_a.right)
-                    ).join(line, condition=line.account == table_c.id
+            # The nested set join is done only on accounts
+            # and the lines are grouped once per active descendant
+            descendants = table_a.join(table_c,
+                condition=(table_c.left >= table_a.left)
+                & (table_c.right <= table_a.right)
+                ).select(table_c.id,
+                where=red_sql & (table_c.active == True))
+            cursor.execute(*table_c.join(source,
+                    condition=source.account == table_c.id
                     ).select(
-                    table_a.id,
-                    Sum(Coalesce(line.debit, 0) - Coalesce(line.credit, 0)),
-                    where=red_sql & line_query & (table_c.active == True),
-                    group_by=table_a.id))
-            result = cursor.fetchall()
-            balances.update(dict(result))
-
-        # SQLite uses float for SUM
-        for account_id, balance in balances.iteritems():
-            if isinstance(balance, Decimal):
-                break
-            balances[account_id] = Decimal(str(balance))
+                    table_c.left,
+                    Sum(Coalesce(source.debit, 0)
+                        - Coalesce(source.credit, 0)),
+                    where=table_c.id.in_(descendants) & source_query,
+                    group_by=table_c.left,
+                    order_by=table_c.left.asc))
+            lefts, sums = [], [Decimal(0)]
+            for left, balance in cursor.fetchall():
+                # SQLite uses float for SUM
+                if not isinstance(balance, Decimal):
+                    balance = Decimal(str(balance))
+                lefts.append(left)
+                sums.append(sums[-1] + balance)
+
+            cursor.execute(*table_a.select(
+                    table_a.id, table_a.left, table_a.right,
+                    where=red_sql))
+            for account_id, left, right in cursor.fetchall():
+                balances[account_id] = (
+                    sums[bisect_right(lefts, right)]
+                    - sums[bisect_left(lefts, left)])
 
         for account in accounts:
             balances[account.id] = account.company.currency.round(
@@ -757,6 +847,7 @@ class Account(ModelSQL, ModelView):
         pool = Pool()
         MoveLine = pool.get('account.move.line')
         FiscalYear = pool.get('account.fiscalyear')
+        PeriodBalance = pool.get('account.account.period_balance')
         cursor = Transaction().connection.cursor()
 
         result = {}
@@ -768,16 +859,21 @@ class Account(ModelSQL, ModelView):
 
         table = cls.__table__()
         line = MoveLine.__table__()
+        period_balance = PeriodBalance.__table__()
         line_query, fiscalyear_ids = MoveLine.query_get(line)
+        source, source_query = line, line_query
+        period_balance_query = PeriodBalance.query_get(period_balance)
+        if period_balance_query is not None:
+            source, source_query = period_balance, period_balance_query
         columns = [table.id]
         for name in names:
-            columns.append(Sum(Coalesce(Column(line, name), 0)))
+            columns.append(Sum(Coalesce(Column(source, name), 0)))
         for sub_ids in grouped_slice(ids):
             red_sql = reduce_ids(table.id, sub_ids)
-            cursor.execute(*table.join(line, 'LEFT',
-                    condition=line.account == table.id
+            cursor.execute(*table.join(source, 'LEFT',
+                    condition=source.account == table.id
                     ).select(*columns,
-                    where=red_sql & line_query,
+                    where=red_sql & source_query,
                     group_by=table.id))
             for row in cursor.fetchall():
                 account_id = row[0]
@@ -815,10 +911,6 @@ class Account(ModelSQL, ModelView):
         Cumulate previous fiscalyear values into values
         func is the method to compute values
         """
-        pool = Pool()
-        FiscalYear = pool.get('account.fiscalyear')
-        Deferral = pool.get('account.account.deferral')
-
         youngest_fiscalyear = None
         for fiscalyear in fiscalyears:
             if (not youngest_fiscalyear
@@ -826,45 +918,132 @@ class Account(ModelSQL, ModelView):
                         > fiscalyear.start_date)):
                 youngest_fiscalyear = fiscalyear
 
-        fiscalyear = None
-        if youngest_fiscalyear:
-            fiscalyears = FiscalYear.search([
-                    ('end_date', '<=', youngest_fiscalyear.start_date),
-                    ('company', '=', youngest_fiscalyear.company),
-                    ], order=[('end_date', 'DESC')], limit=1)
-            if fiscalyears:
-                fiscalyear, = fiscalyears
-
-        if not fiscalyear:
+        if not youngest_fiscalyear:
             return values
 
-        if fiscalyear.state == 'close':
-            id2deferral = {}
-            ids = [a.id for a in accounts]
-            for sub_ids in grouped_slice(ids):
-                deferrals = Deferral.search([
-                    ('fiscalyear', '=', fiscalyear.id),
-                    ('account', 'in', list(sub_ids)),
-                    ])
-                for deferral in deferrals:
-                    id2deferral[deferral.account.id] = deferral
-
+        openings = cls.get_opening(youngest_fiscalyear, accounts, names, func)
+        for name in names:
+            vals = values[name]
             for account in accounts:
-                if account.id in id2deferral:
-                    deferral = id2deferral[account.id]
-                    for name in names:
-                        values[name][account.id] += getattr(deferral, name)
-        else:
-            with Transaction().set_context(fiscalyear=fiscalyear.id,
-                    date=None, periods=None):
+                vals[account.id] += openings[name][account.id]
+        return values
+
+    @classmethod
+    def get_opening(cls, fiscalyear, accounts, names, func):
+        """
+        Return the values of the previous fiscal years of fiscalyear
+        The values are cached for the transaction until a line of a previous
+        fiscal year is modified.
+        func is the method to compute values
+        """
+        Move = Pool().get('account.move')
+        transaction = Transaction()
+        context = transaction.context
+        context_key = (context.get('posted'),
+            context.get('from_date'), context.get('to_date'))
+        cache = cls._opening_cache.setdefault(transaction, {})
+
+        # The cache is cleared by the validation of the moves
+        Move.flush_validate_move()
+        result = dict((n, {}) for n in names)
+        missing = []
+        for account in accounts:
+            for name in names:
+                value = cache.get(
+                    (fiscalyear.id, name, account.id) + context_key)
+                if value is None:
+                    missing.append(account)
+                    break
+                result[name][account.id] = value
+        if missing:
+            openings = cls._compute_opening(fiscalyear, missing, names, func)
+            for name in names:
+                for account in missing:
+                    value = openings[name][account.id]
+                    result[name][account.id] = value
+                    key = (fiscalyear.id, name, account.id) + context_key
+                    cache[key] = value
+        return result
+
+    @classmethod
+    def _compute_opening(cls, fiscalyear, accounts, names, func):
+        """
+        Compute the values of the previous fiscal years of fiscalyear.
+        The lines of the previous open fiscal years are computed at once
+        and the deferrals of the last closed fiscal year are added.
+        """
+        Deferral = Pool().get('account.account.deferral')
+
+        values = dict((n, dict((a.id, 0) for a in accounts)) for n in names)
+
+        periods, closed_fiscalyear = cls.get_previous_fiscalyears(fiscalyear)
+        if periods:
+            with Transaction().set_context(fiscalyear=None,
+                    date=None, periods=[p.id for p in periods]):
                 previous_result = func(accounts, names)
             for name in names:
                 vals = values[name]
                 for account in accounts:
                     vals[account.id] += previous_result[name][account.id]
 
+        if closed_fiscalyear:
+            ids = [a.id for a in accounts]
+            for sub_ids in grouped_slice(ids):
+                deferrals = Deferral.search([
+                    ('fiscalyear', '=', closed_fiscalyear.id),
+                    ('account', 'in', list(sub_ids)),
+                    ])
+                for deferral in deferrals:
+                    for name in names:
+                        values[name][deferral.account.id] += getattr(
+                            deferral, name)
         return values
 
+    @classmethod
+    def get_previous_fiscalyears(cls, fiscalyear):
+        '''
+        Return the periods of the open fiscal years before fiscalyear and
+        the last closed fiscal year before them.
+        '''
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        Period = pool.get('account.period')
+
+        open_fiscalyears = []
+        closed_fiscalyear = None
+        for previous in FiscalYear.search([
+                    ('end_date', '<=', fiscalyear.start_date),
+                    ('company', '=', fiscalyear.company),
+                    ], order=[('end_date', 'DESC')]):
+            if previous.state == 'close':
+                closed_fiscalyear = previous
+                break
+            open_fiscalyears.append(previous)
+
+        periods = Period.search([
+                ('fiscalyear', 'in', [f.id for f in open_fiscalyears]),
+                ])
+        return periods, closed_fiscalyear
+
+    @classmethod
+    def clear_opening_cache(cls, periods=None):
+        """
+        Clear the cached opening values of the transaction.
+        If periods is set, the cache is cleared only if one of the periods
+        belongs to a fiscal year which is not the last one.
+        """
+        FiscalYear = Pool().get('account.fiscalyear')
+        if periods is not None:
+            for fiscalyear in {p.fiscalyear for p in periods}:
+                if FiscalYear.search([
+                            ('start_date', '>=', fiscalyear.end_date),
+                            ('company', '=', fiscalyear.company.id),
+                            ], limit=1):
+                    break
+            else:
+                return
+        cls._opening_cache.pop(Transaction(), None)
+
     def get_rec_name(self, name):
         if self.code:
             return self.code + ' - ' + self.name
@@ -936,9 +1115,16 @@ class Account(ModelSQL, ModelView):
     @classmethod
     def write(cls, *args):
         pool = Pool()
+        Move = pool.get('account.move')
         MoveLine = pool.get('account.move.line')
+        OpenItem = pool.get('account.move.line.open_item')
+        ReconcilePair = pool.get('account.move.line.reconcile_pair')
+        PartyBalance = pool.get('party.party.balance')
         actions = iter(args)
         args = []
+        kind_accounts = []
+        active_accounts = []
+        reconcile_accounts = []
         for accounts, values in zip(actions, actions):
             if not values.get('active', True):
                 childs = cls.search([
@@ -950,7 +1136,25 @@ class Account(ModelSQL, ModelView):
                     values = values.copy()
                     del values['active']
             args.extend((accounts, values))
+            if 'kind' in values:
+                kind_accounts.extend(accounts)
+            elif 'active' in values:
+                active_accounts.extend(accounts)
+            if 'reconcile' in values:
+                reconcile_accounts.extend(accounts)
+        if reconcile_accounts:
+            # The queued amounts depend on the reconcilable accounts
+            Move.flush_validate_move()
         super(Account, cls).write(*args)
+        cls.clear_opening_cache()
+        for sub_ids in grouped_slice([a.id for a in kind_accounts]):
+            sub_ids = list(sub_ids)
+            OpenItem._refresh(
+                lambda line: reduce_ids(line.account, sub_ids))
+        if active_accounts:
+            PartyBalance.refresh(None)
+        for sub_ids in grouped_slice([a.id for a in reconcile_accounts]):
+            ReconcilePair._refresh(list(sub_ids))
 
     @classmethod
     def delete(cls, accounts):
@@ -965,6 +1169,7 @@ class Account(ModelSQL, ModelView):
             cls.raise_user_error('delete_account_containing_move_lines', (
                     lines[0].account.rec_name,))
         super(Account, cls).delete(accounts)
+        cls.clear_opening_cache()
 
     def update_account(self, template2account=None, template2type=None):
         '''
@@ -1123,10 +1328,293 @@ class AccountDeferral(ModelSQL, ModelView):
             ('fiscalyear.rec_name',) + tuple(clause[1:]),
             ]
 
+    @classmethod
+    def create(cls, vlist):
+        Account = Pool().get('account.account')
+        deferrals = super(AccountDeferral, cls).create(vlist)
+        Account.clear_opening_cache()
+        return deferrals
+
     @classmethod
     def write(cls, deferrals, values, *args):
         cls.raise_user_error('write_deferral')
 
+    @classmethod
+    def delete(cls, deferrals):
+        Account = Pool().get('account.account')
+        super(AccountDeferral, cls).delete(deferrals)
+        Account.clear_opening_cache()
+
+
+class AccountPeriodBalance(ModelSQL):
+    '''
+    Account Period Balance
+
+    It stores the sum of the valid move lines by account, period and party.
+    The rows are updated with the difference of the amounts of the modified
+    moves.
+    '''
+    __name__ = 'account.account.period_balance'
+    company = fields.Many2One('company.company', 'Company', required=True,
+        ondelete='CASCADE')
+    account = fields.Many2One('account.account', 'Account', required=True,
+        ondelete='CASCADE')
+    period = fields.Many2One('account.period', 'Period', required=True,
+        ondelete='CASCADE', select=True)
+    party = fields.Many2One('party.party', 'Party', ondelete='CASCADE')
+    posted = fields.Boolean('Posted')
+    debit = fields.Numeric('Debit', required=True)
+    credit = fields.Numeric('Credit', required=True)
+    amount_second_currency = fields.Numeric('Amount Second Currency',
+        required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(AccountPeriodBalance, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('balance_unique',
+                Unique(t, t.company, t.account, t.period, t.party, t.posted),
+                'The balance must be unique per company, account, period, '
+                'party and posted.'),
+            ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        TableHandler = backend.get('TableHandler')
+        exist = TableHandler.table_exist(cls._table)
+
+        super(AccountPeriodBalance, cls).__register__(module_name)
+
+        table = TableHandler(cls, module_name)
+        table.index_action(['account', 'period'], 'add')
+
+        if not exist and TableHandler.table_exist(Line._table):
+            cls._refresh()
+
+    @classmethod
+    def get_amounts(cls, moves):
+        '''
+        Return the debit, credit and amount second currency of the valid lines
+        of the moves by (company, account, period, party, posted)
+        '''
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        line = Line.__table__()
+        move = Move.__table__()
+        cursor = Transaction().connection.cursor()
+
+        amounts = defaultdict(lambda: (Decimal(0),) * 3)
+        for sub_ids in grouped_slice({m.id for m in moves}):
+            cursor.execute(*line.join(move,
+                    condition=line.move == move.id
+                    ).select(move.company, line.account, move.period,
+                    line.party, move.state == 'posted',
+                    Sum(line.debit), Sum(line.credit),
+                    Sum(Coalesce(line.amount_second_currency, 0)),
+                    where=(line.state != 'draft')
+                    & reduce_ids(move.id, sub_ids),
+                    group_by=[move.company, line.account, move.period,
+                        line.party, move.state]))
+            for row in cursor.fetchall():
+                key = row[:4] + (bool(row[4]),)
+                # SQLite uses float for SUM
+                amounts[key] = tuple(a + Decimal(str(v))
+                    for a, v in zip(amounts[key], row[5:]))
+        return dict(amounts)
+
+    @classmethod
+    def update_amounts(cls, old_amounts, new_amounts):
+        '''
+        Add to the balances the difference between the new and old amounts
+        returned by get_amounts
+        '''
+        pool = Pool()
+        Account = pool.get('account.account')
+        Period = pool.get('account.period')
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        zero = (Decimal(0),) * 3
+
+        deltas = {}
+        for key in set(old_amounts) | set(new_amounts):
+            delta = tuple(n - o for n, o in zip(
+                    new_amounts.get(key, zero), old_amounts.get(key, zero)))
+            if any(delta):
+                deltas[key] = delta
+        if not deltas:
+            return
+
+        # Prevent concurrent insertion of the same key
+        transaction.database.lock(transaction.connection, cls._table)
+        period2accounts = defaultdict(set)
+        for sub_keys in grouped_slice(list(deltas)):
+            sub_keys = list(sub_keys)
+            key2id = {}
+            cursor.execute(*table.select(table.id,
+                    table.company, table.account, table.period, table.party,
+                    table.posted,
+                    where=reduce_ids(table.account, {k[1] for k in sub_keys})
+                    & reduce_ids(table.period, {k[2] for k in sub_keys})))
+            for row in cursor.fetchall():
+                key2id[row[1:5] + (bool(row[5]),)] = row[0]
+
+            to_update, to_insert = [], []
+            for key in sub_keys:
+                if key in key2id:
+                    to_update.append((key2id[key],) + deltas[key])
+                else:
+                    to_insert.append(list(key) + list(deltas[key]))
+                period2accounts[key[2]].add(key[1])
+
+            if to_update:
+                # Don't use UPDATE FROM because SQLite nor MySQL support it.
+                values = Values(to_update)
+
+                def get_delta(column):
+                    return values.select(column,
+                        where=values.column1 == table.id)
+                cursor.execute(*table.update([
+                            table.debit, table.credit,
+                            table.amount_second_currency,
+                            ], [
+                            table.debit + get_delta(values.column2),
+                            table.credit + get_delta(values.column3),
+                            table.amount_second_currency
+                            + get_delta(values.column4),
+                            ],
+                        where=reduce_ids(table.id, [r[0] for r in to_update])))
+            if to_insert:
+                cursor.execute(*table.insert([
+                            table.company, table.account, table.period,
+                            table.party, table.posted, table.debit,
+                            table.credit, table.amount_second_currency,
+                            ], to_insert))
+
+        for period_id, account_ids in period2accounts.iteritems():
+            for sub_ids in grouped_slice(account_ids):
+                cursor.execute(*table.delete(
+                        where=(table.period == period_id)
+                        & reduce_ids(table.account, sub_ids)
+                        & (table.debit == 0) & (table.credit == 0)
+                        & (table.amount_second_currency == 0)))
+        if period2accounts:
+            Account.clear_opening_cache(Period.browse(period2accounts.keys()))
+
+    @classmethod
+    def _refresh(cls, party_ids=None):
+        '''
+        Replace the rows of the parties by the sum of the lines.
+        If party_ids is None, all the rows are replaced.
+        '''
+        pool = Pool()
+        Account = pool.get('account.account')
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        table = cls.__table__()
+        line = Line.__table__()
+        move = Move.__table__()
+        cursor = Transaction().connection.cursor()
+
+        table_where = Literal(True)
+        line_where = line.state != 'draft'
+        if party_ids is not None:
+            table_where &= reduce_ids(table.party, party_ids)
+            line_where &= reduce_ids(line.party, party_ids)
+
+        cursor.execute(*table.delete(where=table_where))
+        cursor.execute(*table.insert([
+                    table.company, table.account, table.period, table.party,
+                    table.posted, table.debit, table.credit,
+                    table.amount_second_currency,
+                    ],
+                line.join(move, condition=line.move == move.id
+                    ).select(move.company, line.account, move.period,
+                    line.party, move.state == 'posted',
+                    Sum(line.debit), Sum(line.credit),
+                    Sum(Coalesce(line.amount_second_currency, 0)),
+                    where=line_where,
+                    group_by=[move.company, line.account, move.period,
+                        line.party, move.state])))
+        Account.clear_opening_cache()
+
+    @classmethod
+    def get_period_ids(cls):
+        '''
+        Return the list of period ids selected by the move line context
+        or None if the context is not aligned on period boundaries.
+        '''
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        Period = pool.get('account.period')
+        context = Transaction().context
+        company = context.get('company')
+
+        date = context.get('date')
+        from_date, to_date = context.get('from_date'), context.get('to_date')
+        fiscalyear_id = context.get('fiscalyear')
+        period_ids = context.get('periods')
+        if date:
+            fiscalyears = FiscalYear.search([
+                    ('start_date', '<=', date),
+                    ('end_date', '>=', date),
+                    ('company', '=', company),
+                    ], limit=1)
+            if not fiscalyears:
+                return []
+            domain = [('fiscalyear', '=', fiscalyears[0].id)]
+            from_date, to_date = None, date
+        elif fiscalyear_id or period_ids or from_date or to_date:
+            domain = []
+            if fiscalyear_id:
+                domain.append(('fiscalyear', '=', fiscalyear_id))
+            if period_ids:
+                domain.append(('id', 'in', period_ids))
+        else:
+            domain = [
+                ('fiscalyear.state', '=', 'open'),
+                ('fiscalyear.company', '=', company),
+                ]
+
+        result = []
+        for period in Period.search(domain, order=[]):
+            if from_date:
+                if period.end_date < from_date:
+                    continue
+                elif period.start_date < from_date:
+                    return None
+            if to_date:
+                if period.start_date > to_date:
+                    continue
+                elif period.end_date > to_date:
+                    return None
+            result.append(period.id)
+        return result
+
+    @classmethod
+    def query_get(cls, table):
+        '''
+        Return SQL clause for the period balances depending of the context
+        or None if the move lines must be used.
+        table is the SQL instance of account.account.period_balance table
+        '''
+        Move = Pool().get('account.move')
+        Move.flush_validate_move()
+        period_ids = cls.get_period_ids()
+        if period_ids is None:
+            return None
+        if period_ids:
+            where = table.period.in_(period_ids)
+        else:
+            where = Literal(False)
+        if Transaction().context.get('posted'):
+            where &= table.posted == True
+        return where
+
 
 class AccountTax(ModelSQL):
     'Account - Tax'
@@ -1192,7 +1680,7 @@ class GeneralLedgerAccount(ModelSQL, ModelView):
     debit = fields.Function(fields.Numeric('Debit',
             digits=(16, Eval('currency_digits', 2)),
             depends=['currency_digits']),
-        'get_debit_credit', searcher='search_debit_credit')
+        'get_account', searcher='search_debit_credit')
     end_debit = fields.Function(fields.Numeric('End Debit',
             digits=(16, Eval('currency_digits', 2)),
             depends=['currency_digits']),
@@ -1204,7 +1692,7 @@ class GeneralLedgerAccount(ModelSQL, ModelView):
     credit = fields.Function(fields.Numeric('Credit',
             digits=(16, Eval('currency_digits', 2)),
             depends=['currency_digits']),
-        'get_debit_credit', searcher='search_debit_credit')
+        'get_account', searcher='search_debit_credit')
     end_credit = fields.Function(fields.Numeric('End Credit',
             digits=(16, Eval('currency_digits', 2)),
             depends=['currency_digits']),
@@ -1283,93 +1771,249 @@ class GeneralLedgerAccount(ModelSQL, ModelView):
         return None, None
 
     @classmethod
-    def get_account(cls, records, name):
+    def get_account(cls, records, names):
+        """
+        Compute all the start, period and end figures at once using
+        conditional sums over the lines.
+        """
         pool = Pool()
         Account = pool.get('account.account')
+        MoveLine = pool.get('account.move.line')
+        FiscalYear = pool.get('account.fiscalyear')
+        PeriodBalance = pool.get('account.account.period_balance')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
 
-        period_ids = cls.get_period_ids(name)
-        from_date, to_date = cls.get_dates(name)
-        with Transaction().set_context(
-                periods=period_ids,
-                from_date=from_date, to_date=to_date):
-            accounts = Account.browse(records)
-        fname = name
-        for test in ['start_', 'end_']:
-            if name.startswith(test):
-                fname = name[len(test):]
-                break
-        return {a.id: getattr(a, fname) for a in accounts}
+        table_a = Account.__table__()
+        table_c = Account.__table__()
+        line = MoveLine.__table__()
+        period_balance = PeriodBalance.__table__()
+
+        start_period_ids = cls.get_period_ids('start_balance')
+        end_period_ids = cls.get_period_ids('end_balance')
+        contexts = {}
+        for prefix in {n[:-len(n.split('_')[-1])] for n in names}:
+            if prefix:
+                from_date, to_date = cls.get_dates(prefix)
+                contexts[prefix] = {
+                    'periods': (start_period_ids if prefix == 'start_'
+                        else end_period_ids),
+                    'from_date': from_date,
+                    'to_date': to_date,
+                    }
+            else:
+                contexts[prefix] = {
+                    'periods': list(
+                        set(end_period_ids).difference(
+                            set(start_period_ids))),
+                    }
+
+        queries, fiscalyear_ids = {}, {}
+        use_period_balance = True
+        for prefix, context in contexts.iteritems():
+            with transaction.set_context(context):
+                queries[prefix], fiscalyear_ids[prefix] = (
+                    MoveLine.query_get(line))
+                queries[prefix, 'period_balance'] = PeriodBalance.query_get(
+                    period_balance)
+            if queries[prefix, 'period_balance'] is None:
+                use_period_balance = False
+        source = line
+        if use_period_balance:
+            source = period_balance
+            for prefix in contexts:
+                queries[prefix] = queries[prefix, 'period_balance']
+
+        prefixes = sorted(contexts)
+        columns = []
+        where = Literal(False)
+        for prefix in prefixes:
+            for fname in ['debit', 'credit']:
+                columns.append(Sum(Case((queries[prefix],
+                                Coalesce(Column(source, fname), 0)),
+                            else_=0)))
+            where |= queries[prefix]
+
+        ids = [r.id for r in records]
+        accounts = Account.browse(ids)
+        values = dict((p, {
+                    'debit': dict((i, 0) for i in ids),
+                    'credit': dict((i, 0) for i in ids),
+                    'balance': dict((i, 0) for i in ids),
+                    }) for p in prefixes)
+        for sub_ids in grouped_slice(ids):
+            red_sql = reduce_ids(table_a.id, sub_ids)
+            descendants = table_a.join(table_c,
+                condition=(table_c.left >= table_a.left)
+                & (table_c.right <= table_a.right)
+                ).select(table_c.id,
+                where=red_sql
+                & ((table_c.active == True) | (table_c.id == table_a.id)))
+            cursor.execute(*table_c.join(source,
+                    condition=source.account == table_c.id
+                    ).select(table_c.id, table_c.left, table_c.active,
+                    *columns,
+                    where=table_c.id.in_(descendants) & where,
+                    group_by=[table_c.id, table_c.left, table_c.active],
+                    order_by=table_c.left.asc))
+            lefts = []
+            sums = dict((p, [Decimal(0)]) for p in prefixes)
+            for row in cursor.fetchall():
+                account_id, left, active = row[:3]
+                amounts = []
+                for amount in row[3:]:
+                    # SQLite uses float for SUM
+                    if not isinstance(amount, Decimal):
+                        amount = Decimal(str(amount))
+                    amounts.append(amount)
+                if active:
+                    lefts.append(left)
+                for i, prefix in enumerate(prefixes):
+                    debit, credit = amounts[2 * i:2 * i + 2]
+                    if account_id in values[prefix]['debit']:
+                        values[prefix]['debit'][account_id] = debit
+                        values[prefix]['credit'][account_id] = credit
+                    if active:
+                        sums[prefix].append(
+                            sums[prefix][-1] + debit - credit)
+
+            cursor.execute(*table_a.select(
+                    table_a.id, table_a.left, table_a.right,
+                    where=red_sql))
+            for account_id, left, right in cursor.fetchall():
+                start = bisect_left(lefts, left)
+                end = bisect_right(lefts, right)
+                for prefix in prefixes:
+                    values[prefix]['balance'][account_id] = (
+                        sums[prefix][end] - sums[prefix][start])
+
+        for prefix in prefixes:
+            for account in accounts:
+                for fname in ['debit', 'credit', 'balance']:
+                    values[prefix][fname][account.id] = (
+                        account.company.currency.round(
+                            values[prefix][fname][account.id]))
+
+            fiscalyears = FiscalYear.browse(fiscalyear_ids[prefix])
+            with transaction.set_context(contexts[prefix]):
+                Account._cumulate(fiscalyears, accounts, ['balance'],
+                    values[prefix], lambda accounts, names: {
+                        names[0]: Account.get_balance(accounts, names[0])})
+                if transaction.context.get('cumulate'):
+                    Account._cumulate(fiscalyears, accounts,
+                        ['debit', 'credit'], values[prefix],
+                        Account.get_credit_debit)
+
+        result = {}
+        for name in names:
+            prefix = name[:-len(name.split('_')[-1])]
+            result[name] = values[prefix][name[len(prefix):]]
+        return result
 
     @classmethod
     def search_account(cls, name, domain):
-        pool = Pool()
-        Account = pool.get('account.account')
-
         period_ids = cls.get_period_ids(name)
-        with Transaction().set_context(periods=period_ids):
-            accounts = Account.search([], order=[])
-
-        _, operator_, operand = domain
-        operator_ = {
-            '=': operator.eq,
-            '>=': operator.ge,
-            '>': operator.gt,
-            '<=': operator.le,
-            '<': operator.lt,
-            '!=': operator.ne,
-            'in': lambda v, l: v in l,
-            'not in': lambda v, l: v not in l,
-            }.get(operator_, lambda v, l: False)
         fname = name
         for test in ['start_', 'end_']:
             if name.startswith(test):
                 fname = name[len(test):]
                 break
-
-        ids = [a.id for a in accounts
-            if operator_(getattr(a, fname), operand)]
-        return [('id', 'in', ids)]
+        with Transaction().set_context(periods=period_ids):
+            return cls._search_amount(fname, domain)
 
     @classmethod
-    def get_debit_credit(cls, records, name):
-        pool = Pool()
-        Account = pool.get('account.account')
-
+    def search_debit_credit(cls, name, domain):
         start_period_ids = cls.get_period_ids('start_%s' % name)
         end_period_ids = cls.get_period_ids('end_%s' % name)
         periods_ids = list(
             set(end_period_ids).difference(set(start_period_ids)))
         with Transaction().set_context(periods=periods_ids):
-            accounts = Account.browse(records)
-        return {a.id: getattr(a, name) for a in accounts}
+            return cls._search_amount(name, domain)
 
     @classmethod
-    def search_debit_credit(cls, name, domain):
+    def _search_amount(cls, fname, domain):
+        """
+        Return the domain matching the accounts for which the fname
+        (debit, credit or balance) of the current context satisfies domain.
+        """
         pool = Pool()
         Account = pool.get('account.account')
+        MoveLine = pool.get('account.move.line')
+        FiscalYear = pool.get('account.fiscalyear')
+        Deferral = pool.get('account.account.deferral')
+        transaction = Transaction()
+        context = transaction.context
 
-        start_period_ids = cls.get_period_ids('start_%s' % name)
-        end_period_ids = cls.get_period_ids('end_%s' % name)
-        periods_ids = list(
-            set(end_period_ids).difference(set(start_period_ids)))
-        with Transaction().set_context(periods=periods_ids):
-            accounts = Account.search([], order=[])
-
-        _, operator_, operand = domain
-        operator_ = {
-            '=': operator.eq,
-            '>=': operator.ge,
-            '>': operator.gt,
-            '<=': operator.le,
-            '<': operator.lt,
-            '!=': operator.ne,
-            'in': lambda v, l: v in l,
-            'not in': lambda v, l: v not in l,
-            }.get(operator_, lambda v, l: False)
-
-        ids = [a.id for a in accounts
-            if operator_(getattr(a, name), operand)]
-        return [('id', 'in', ids)]
+        _, operator_, value = domain
+        if operator_ not in {'=', '>=', '>', '<=', '<', '!=', 'in', 'not in'}:
+            return [('id', 'in', [])]
+        Operator = fields.SQL_OPERATORS[operator_]
+
+        table_a = Account.__table__()
+        table_c = Account.__table__()
+        line = MoveLine.__table__()
+        deferral = Deferral.__table__()
+
+        def amount(table):
+            if fname == 'balance':
+                return Coalesce(table.debit, 0) - Coalesce(table.credit, 0)
+            return Coalesce(Column(table, fname), 0)
+
+        line_query, fiscalyear_ids = MoveLine.query_get(line)
+        amounts = line.select(line.account.as_('account'),
+            amount(line).as_('amount'), Literal(True).as_('rollup'),
+            where=line_query)
+
+        fiscalyears = FiscalYear.browse(fiscalyear_ids)
+        if fiscalyears and (fname == 'balance' or context.get('cumulate')):
+            youngest_fiscalyear = min(fiscalyears,
+                key=lambda f: f.start_date)
+            periods, closed_fiscalyear = Account.get_previous_fiscalyears(
+                youngest_fiscalyear)
+            if periods:
+                opening_line = MoveLine.__table__()
+                with transaction.set_context(fiscalyear=None,
+                        date=None, periods=[p.id for p in periods]):
+                    opening_query, _ = MoveLine.query_get(opening_line)
+                amounts = Union(amounts, opening_line.select(
+                        opening_line.account, amount(opening_line),
+                        Literal(True), where=opening_query),
+                    all_=True)
+            if closed_fiscalyear:
+                # Deferrals are not cumulated on the parents
+                amounts = Union(amounts, deferral.select(
+                        deferral.account, amount(deferral), Literal(False),
+                        where=deferral.fiscalyear == closed_fiscalyear.id),
+                    all_=True)
+
+        if fname == 'balance':
+            query = table_a.join(table_c,
+                condition=(table_c.left >= table_a.left)
+                & (table_c.right <= table_a.right)
+                & (table_c.active == True)
+                ).join(amounts, 'LEFT',
+                condition=(amounts.account == table_c.id)
+                & (amounts.rollup | (table_c.id == table_a.id)))
+        else:
+            query = table_a.join(amounts, 'LEFT',
+                condition=amounts.account == table_a.id)
+
+        where = Literal(True)
+        if context.get('active_test', True):
+            where &= table_a.active == True
+
+        # Need to cast numeric for sqlite
+        type_ = MoveLine.debit.sql_type().base
+        total = Cast(Coalesce(Sum(amounts.amount), 0), type_)
+        if operator_ in {'in', 'not in'}:
+            value = [Cast(Literal(Decimal(v or 0)), type_) for v in value]
+        else:
+            value = Cast(Literal(Decimal(value or 0)), type_)
+        query = query.select(table_a.id,
+            where=where,
+            group_by=table_a.id,
+            having=Operator(total, value))
+        return [('id', 'in', query)]
 
     def get_currency_digits(self, name):
         return self.company.currency.digits
@@ -1475,9 +2119,11 @@ class GeneralLedgerLine(ModelSQL, ModelView):
     credit = fields.Numeric('Credit',
         digits=(16, Eval('currency_digits', 2)),
         depends=['currency_digits'])
+    # Lazy to be read only with the running balances when the database has no
+    # window functions
     balance = fields.Numeric('Balance',
         digits=(16, Eval('currency_digits', 2)),
-        depends=['currency_digits'])
+        depends=['currency_digits'], loading='lazy')
     origin = fields.Reference('Origin', selection='get_origin')
     description = fields.Char('Description')
     move_description = fields.Char('Move Description')
@@ -1499,7 +2145,6 @@ class GeneralLedgerLine(ModelSQL, ModelView):
         pool = Pool()
         Line = pool.get('account.move.line')
         Move = pool.get('account.move')
-        LedgerAccount = pool.get('account.general_ledger.account')
         Account = pool.get('account.account')
         transaction = Transaction()
         database = transaction.database
@@ -1508,20 +2153,17 @@ class GeneralLedgerLine(ModelSQL, ModelView):
         move = Move.__table__()
         account = Account.__table__()
         columns = []
+        fnames = []
         for fname, field in cls._fields.iteritems():
             if hasattr(field, 'set'):
                 continue
             field_line = getattr(Line, fname, None)
-            if fname == 'balance':
-                if database.has_window_functions():
-                    w_columns = [line.account]
-                    if context.get('party_cumulate', False):
-                        w_columns.append(line.party)
-                    column = Sum(line.debit - line.credit,
-                        window=Window(w_columns,
-                            order_by=[move.date.asc, line.id])).as_('balance')
-                else:
-                    column = (line.debit - line.credit).as_('balance')
+            if fname == 'id':
+                # Even ids for the lines and odd ids for the opening rows
+                column = (line.id * 2).as_(fname)
+            elif fname == 'balance':
+                # The amount of the line for the running balance
+                column = (line.debit - line.credit).as_(fname)
             elif fname == 'move_description':
                 column = Column(move, 'description').as_(fname)
             elif fname == 'party_required':
@@ -1533,14 +2175,252 @@ class GeneralLedgerLine(ModelSQL, ModelView):
             else:
                 column = Column(line, fname).as_(fname)
             columns.append(column)
+            fnames.append(fname)
+        line_query = cls.get_line_query(line)
+        query = line.join(move, condition=line.move == move.id
+            ).join(account, condition=line.account == account.id
+                ).select(*columns, where=line_query)
+
+        opening = cls.get_opening_query()
+        if opening is not None:
+            opening_account = Account.__table__()
+            opening_date = cls.get_opening_date()
+            columns = []
+            for fname in fnames:
+                if fname in {'id', 'account', 'party', 'debit', 'credit'}:
+                    column = Column(opening, fname)
+                elif fname == 'balance':
+                    column = opening.debit - opening.credit
+                elif fname in {'company', 'party_required'}:
+                    column = Column(opening_account, fname)
+                elif fname == 'date':
+                    column = Literal(opening_date)
+                else:
+                    column = Null
+                columns.append(column.as_(fname)
+                    if column is not Null else Literal(None).as_(fname))
+            # The lines are the last query of the union for SQLite to keep
+            # the type of their columns
+            query = Union(opening.join(opening_account,
+                    condition=opening.account == opening_account.id
+                    ).select(*columns), query,
+                all_=True)
+        if not database.has_window_functions():
+            return query
+
+        w_columns = [query.account]
+        if context.get('party_cumulate', False):
+            w_columns.append(query.party)
+        columns = []
+        for fname in fnames:
+            if fname == 'balance':
+                column = Sum(query.balance,
+                    window=Window(w_columns,
+                        order_by=[query.date.asc,
+                            Case((query.move == Null, 0), else_=1),
+                            query.id]))
+            else:
+                column = Column(query, fname)
+            columns.append(column.as_(fname))
+        return query.select(*columns)
+
+    @classmethod
+    def get_opening_query(cls):
+        """
+        Return the query of the opening debit and credit by account
+        (and party if party_cumulate) before the range of the general ledger
+        or None if the range starts with the fiscal year.
+        The opening rows have an odd id computed from the account and party.
+        """
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        LedgerAccount = pool.get('account.general_ledger.account')
+        PeriodBalance = pool.get('account.account.period_balance')
+        transaction = Transaction()
+        context = transaction.context
+        line = Line.__table__()
+        period_balance = PeriodBalance.__table__()
+
+        start_period_ids = LedgerAccount.get_period_ids('start_balance')
+        end_period_ids = LedgerAccount.get_period_ids('end_balance')
+        period_ids = list(
+            set(end_period_ids).difference(set(start_period_ids)))
+        from_date = context.get('from_date')
+
+        queries = []
+        if start_period_ids != [0] and period_ids:
+            with transaction.set_context(periods=start_period_ids,
+                    date=None, from_date=None, to_date=None):
+                where = PeriodBalance.query_get(period_balance)
+            queries.append(period_balance.select(
+                    period_balance.account.as_('account'),
+                    period_balance.party.as_('party'),
+                    period_balance.debit.as_('debit'),
+                    period_balance.credit.as_('credit'),
+                    where=where))
+        if from_date:
+            with transaction.set_context(periods=period_ids,
+                    date=None, from_date=None,
+                    to_date=from_date - datetime.timedelta(days=1)):
+                where, _ = Line.query_get(line)
+            queries.append(line.select(
+                    line.account.as_('account'),
+                    line.party.as_('party'),
+                    line.debit.as_('debit'),
+                    line.credit.as_('credit'),
+                    where=where))
+        if not queries:
+            return None
+        elif len(queries) > 1:
+            amounts = Union(*queries, all_=True)
+        else:
+            amounts, = queries
+
+        group_by = [amounts.account]
+        if context.get('party_cumulate', False):
+            party = amounts.party
+            group_by.append(amounts.party)
+        else:
+            party = Literal(None)
+        # Odd id from twice the Cantor pairing of account and party
+        pair = Cast(amounts.account, 'BIGINT') + Coalesce(party, 0)
+        return amounts.select(
+            (pair * (pair + 1) + Coalesce(party, 0) * 2 + 1).as_('id'),
+            amounts.account.as_('account'),
+            party.as_('party'),
+            Sum(amounts.debit).as_('debit'),
+            Sum(amounts.credit).as_('credit'),
+            group_by=group_by)
+
+    @classmethod
+    def get_opening_date(cls):
+        'Return the date of the opening rows'
+        pool = Pool()
+        Period = pool.get('account.period')
+        FiscalYear = pool.get('account.fiscalyear')
+        LedgerAccount = pool.get('account.general_ledger.account')
+        context = Transaction().context
+        if context.get('from_date'):
+            return context['from_date']
+        start_period_ids = set(LedgerAccount.get_period_ids('start_balance'))
+        end_period_ids = set(LedgerAccount.get_period_ids('end_balance'))
+        period_ids = list(end_period_ids.difference(start_period_ids))
+        if period_ids:
+            return min(p.start_date for p in Period.browse(period_ids))
+        elif context.get('fiscalyear'):
+            return FiscalYear(context['fiscalyear']).start_date
+        return datetime.date.min
+
+    @classmethod
+    def get_line_query(cls, line):
+        'Return the SQL clause of the move lines of the general ledger'
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        LedgerAccount = pool.get('account.general_ledger.account')
         start_period_ids = set(LedgerAccount.get_period_ids('start_balance'))
         end_period_ids = set(LedgerAccount.get_period_ids('end_balance'))
         period_ids = list(end_period_ids.difference(start_period_ids))
         with Transaction().set_context(periods=period_ids):
             line_query, fiscalyear_ids = Line.query_get(line)
-        return line.join(move, condition=line.move == move.id
-            ).join(account, condition=line.account == account.id
-                ).select(*columns, where=line_query)
+        return line_query
+
+    @classmethod
+    def read(cls, ids, fields_names=None):
+        database = Transaction().database
+        if database.has_window_functions() or (
+                fields_names and 'balance' not in fields_names):
+            return super(GeneralLedgerLine, cls).read(ids,
+                fields_names=fields_names)
+        # The balance column is only the amount of the line
+        fields_names = [n for n in (fields_names or cls._fields.keys())
+            if n != 'balance']
+        result = super(GeneralLedgerLine, cls).read(ids,
+            fields_names=fields_names or ['id'])
+        balances = cls.get_running_balances(ids)
+        for values in result:
+            values['balance'] = balances.get(values['id'])
+        return result
+
+    @classmethod
+    def get_running_balances(cls, ids):
+        """
+        Return the running balance of the lines for database without window
+        functions.
+        The lines of each account (and party if party_cumulate) are streamed
+        in date order from the first to the last requested line, starting
+        with the opening amount and the sum of the previous lines.
+        The balance of the opening rows is their amount.
+        """
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        party_cumulate = transaction.context.get('party_cumulate', False)
+        line = Line.__table__()
+        move = Move.__table__()
+
+        line_ids = [i // 2 for i in ids if not i % 2]
+        opening_ids = {i for i in ids if i % 2}
+        groups = defaultdict(list)
+        for sub_ids in grouped_slice(line_ids):
+            cursor.execute(*line.join(move, condition=line.move == move.id
+                    ).select(line.id, line.account, line.party, move.date,
+                    where=reduce_ids(line.id, sub_ids)))
+            for line_id, account_id, party_id, date in cursor.fetchall():
+                if not party_cumulate:
+                    party_id = None
+                groups[(account_id, party_id)].append((date, line_id))
+
+        balances = {}
+        openings = {}
+        opening = cls.get_opening_query()
+        if opening is not None:
+            cursor.execute(*opening.select(opening.id,
+                    opening.account, opening.party,
+                    opening.debit - opening.credit))
+            for opening_id, account_id, party_id, amount in cursor.fetchall():
+                # SQLite uses float for SUM
+                amount = Decimal(str(amount))
+                openings[(account_id, party_id)] = amount
+                if opening_id in opening_ids:
+                    balances[opening_id] = amount
+
+        line_query = cls.get_line_query(line)
+        for (account_id, party_id), keys in groups.iteritems():
+            requested = {k[1] for k in keys}
+            (first_date, first_id), (last_date, last_id) = (
+                min(keys), max(keys))
+            where = line_query & (line.account == account_id)
+            if party_cumulate:
+                if party_id:
+                    where &= line.party == party_id
+                else:
+                    where &= line.party == Null
+            before = ((move.date < first_date)
+                | ((move.date == first_date) & (line.id < first_id)))
+            until = ((move.date < last_date)
+                | ((move.date == last_date) & (line.id <= last_id)))
+            from_ = line.join(move, condition=line.move == move.id)
+
+            cursor.execute(*from_.select(
+                    Sum(line.debit - line.credit),
+                    where=where & before))
+            balance, = cursor.fetchone()
+            # SQLite uses float for SUM
+            balance = Decimal(str(balance or 0))
+            balance += openings.get((account_id, party_id), 0)
+
+            cursor.execute(*from_.select(line.id, line.debit - line.credit,
+                    where=where & ~before & until,
+                    order_by=[move.date.asc, line.id.asc]))
+            for line_id, amount in cursor:
+                if not isinstance(amount, Decimal):
+                    amount = Decimal(str(amount))
+                balance += amount
+                if line_id in requested:
+                    balances[line_id * 2] = balance
+        return balances
 
     def get_party_required(self, name):
         return self.account.party_required
@@ -1887,17 +2767,42 @@ class AgedBalance(ModelSQL, ModelView):
         Move = pool.get('account.move')
         Reconciliation = pool.get('account.move.reconciliation')
         Account = pool.get('account.account')
+        OpenItem = pool.get('account.move.line.open_item')
 
         line = MoveLine.__table__()
+        reconciled_line = MoveLine.__table__()
         move = Move.__table__()
         reconciliation = Reconciliation.__table__()
         account = Account.__table__()
+        open_item = OpenItem.__table__()
 
         company_id = context.get('company')
         date = context.get('date')
         with Transaction().set_context(date=None):
             line_query, _ = MoveLine.query_get(line)
         kind = cls.get_kind()
+
+        # The open items and the lines reconciled after the date
+        items = Union(
+            open_item.select(open_item.line.as_('line'),
+                open_item.maturity_date.as_('maturity_date'),
+                open_item.amount.as_('amount'),
+                where=(open_item.date <= date)
+                & (open_item.company == company_id)),
+            reconciled_line.join(move,
+                condition=reconciled_line.move == move.id
+                ).select(reconciled_line.id,
+                reconciled_line.maturity_date,
+                Coalesce(reconciled_line.debit, 0)
+                - Coalesce(reconciled_line.credit, 0),
+                where=reconciled_line.reconciliation.in_(
+                    reconciliation.select(reconciliation.id,
+                        where=reconciliation.date > date))
+                & (reconciled_line.party != Null)
+                & (move.date <= date)
+                & (move.company == company_id)),
+            all_=True)
+
         columns = [
             line.party.as_('id'),
             Literal(0).as_('create_uid'),
@@ -1905,8 +2810,8 @@ class AgedBalance(ModelSQL, ModelView):
             Literal(0).as_('write_uid'),
             Max(line.write_date).as_('write_date'),
             line.party.as_('party'),
-            move.company.as_('company'),
-            (Sum(line.debit) - Sum(line.credit)).as_('balance'),
+            account.company.as_('company'),
+            Sum(items.amount).as_('balance'),
             ]
 
         terms = cls.get_terms()
@@ -1917,30 +2822,24 @@ class AgedBalance(ModelSQL, ModelView):
             if value is None or factor is None or date is None:
                 columns.append(Literal(None).as_(name))
                 continue
-            cond = line.maturity_date <= (date - value * factor)
+            cond = items.maturity_date <= (date - value * factor)
             idx = term_values.index(value)
             if idx + 1 < len(terms):
-                cond &= line.maturity_date > (
+                cond &= items.maturity_date > (
                     date - term_values[idx + 1] * factor)
             else:
-                cond |= line.maturity_date == Null
+                cond |= items.maturity_date == Null
             columns.append(
-                Sum(Case((cond, line.debit - line.credit), else_=0)).as_(name))
+                Sum(Case((cond, items.amount), else_=0)).as_(name))
 
-        return line.join(move, condition=line.move == move.id
+        return items.join(line, condition=items.line == line.id
             ).join(account, condition=line.account == account.id
-            ).join(reconciliation, 'LEFT',
-                condition=reconciliation.id == line.reconciliation
             ).select(*columns,
-                where=(line.party != Null)
-                & (account.active == True)
+                where=(account.active == True)
                 & account.kind.in_(kind)
-                & ((line.reconciliation == Null)
-                    | (reconciliation.date > date))
-                & (move.date <= date)
                 & (account.company == company_id)
                 & line_query,
-                group_by=(line.party, move.company))
+                group_by=(line.party, account.company))
 
     @classmethod
     def get_terms(cls):
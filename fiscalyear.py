@@ -4,6 +4,7 @@ from __future__ import division
 
 from dateutil.relativedelta import relativedelta
 from trytond.model import ModelView, ModelSQL, Workflow, fields
+from trytond.cache import Cache
 from trytond.wizard import Wizard, StateView, StateAction, Button
 from trytond.tools import datetime_strftime
 from trytond.pyson import Eval, If, PYSONEncoder
@@ -54,6 +55,7 @@ class FiscalYear(Workflow, ModelSQL, ModelView):
                 Eval('context', {}).get('company', -1)),
             ], select=True)
     icon = fields.Function(fields.Char("Icon"), 'get_icon')
+    _find_cache = Cache('account.fiscalyear.find', context=False)
 
     @classmethod
     def __setup__(cls):
@@ -157,6 +159,10 @@ class FiscalYear(Workflow, ModelSQL, ModelView):
 
     @classmethod
     def write(cls, *args):
+        pool = Pool()
+        Period = pool.get('account.period')
+        Account = pool.get('account.account')
+        Line = pool.get('account.move.line')
         actions = iter(args)
         for fiscalyears, values in zip(actions, actions):
             if values.get('post_move_sequence'):
@@ -167,12 +173,33 @@ class FiscalYear(Workflow, ModelSQL, ModelView):
                         cls.raise_user_error('change_post_move_sequence', (
                                 fiscalyear.rec_name,))
         super(FiscalYear, cls).write(*args)
+        cls._find_cache.clear()
+        Period._find_cache.clear()
+        Account.clear_opening_cache()
+        Line.clear_query_get_cache()
+
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        Account = pool.get('account.account')
+        Line = pool.get('account.move.line')
+        fiscalyears = super(FiscalYear, cls).create(vlist)
+        cls._find_cache.clear()
+        Account.clear_opening_cache()
+        Line.clear_query_get_cache()
+        return fiscalyears
 
     @classmethod
     def delete(cls, fiscalyears):
-        Period = Pool().get('account.period')
+        pool = Pool()
+        Period = pool.get('account.period')
+        Account = pool.get('account.account')
+        Line = pool.get('account.move.line')
         Period.delete([p for f in fiscalyears for p in f.periods])
         super(FiscalYear, cls).delete(fiscalyears)
+        cls._find_cache.clear()
+        Account.clear_opening_cache()
+        Line.clear_query_get_cache()
 
     @classmethod
     @ModelView.button
@@ -226,18 +253,23 @@ class FiscalYear(Workflow, ModelSQL, ModelView):
 
         if not date:
             date = Date.today()
-        fiscalyears = cls.search([
-            ('start_date', '<=', date),
-            ('end_date', '>=', date),
-            ('company', '=', company_id),
-            ], order=[('start_date', 'DESC')], limit=1)
-        if not fiscalyears:
+        key = (company_id, date)
+        fiscalyear_id = cls._find_cache.get(key, -1)
+        if fiscalyear_id == -1:
+            fiscalyears = cls.search([
+                ('start_date', '<=', date),
+                ('end_date', '>=', date),
+                ('company', '=', company_id),
+                ], order=[('start_date', 'DESC')], limit=1)
+            fiscalyear_id = fiscalyears[0].id if fiscalyears else None
+            cls._find_cache.set(key, fiscalyear_id)
+        if not fiscalyear_id:
             if exception:
                 lang = Lang.get()
                 cls.raise_user_error('no_fiscalyear_date', lang.strftime(date))
             else:
                 return None
-        return fiscalyears[0].id
+        return fiscalyear_id
 
     def get_deferral(self, account):
         'Computes deferrals for accounts'
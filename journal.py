@@ -1,12 +1,15 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+from collections import defaultdict
 from decimal import Decimal
+from weakref import WeakKeyDictionary
 
-from sql import Null
+from sql import Literal, Values
 from sql.aggregate import Sum
 
 from trytond.model import ModelView, ModelSQL, Workflow, fields, Unique
 from trytond import backend
+from trytond.config import config
 from trytond.pyson import Eval, Bool
 from trytond.transaction import Transaction
 from trytond.pool import Pool
@@ -16,7 +19,7 @@ from trytond.modules.company.model import (
     CompanyMultiValueMixin, CompanyValueMixin)
 
 __all__ = ['JournalType', 'Journal', 'JournalSequence', 'JournalAccount',
-    'JournalCashContext',
+    'JournalDailyTotal', 'JournalCashContext',
     'JournalPeriod']
 
 STATES = {
@@ -173,9 +176,11 @@ class Journal(ModelSQL, ModelView, CompanyMultiValueMixin):
         pool = Pool()
         MoveLine = pool.get('account.move.line')
         Move = pool.get('account.move')
+        DailyTotal = pool.get('account.journal.daily_total')
         context = Transaction().context
         cursor = Transaction().connection.cursor()
 
+        Move.flush_validate_move()
         result = {}
         ids = [j.id for j in journals]
         for name in ['debit', 'credit', 'balance']:
@@ -183,30 +188,37 @@ class Journal(ModelSQL, ModelView, CompanyMultiValueMixin):
 
         line = MoveLine.__table__()
         move = Move.__table__()
-        where = ((move.date >= context['start_date'])
-            & (move.date <= context['end_date']))
+        daily_total = DailyTotal.__table__()
+        use_daily_total = DailyTotal.built()
         for sub_journals in grouped_slice(journals):
-            sub_journals = list(sub_journals)
-            red_sql = reduce_ids(move.journal, [j.id for j in sub_journals])
-            accounts = None
+            # Map the journals to their cash accounts with a VALUES table
+            # joined against the lines instead of one clause per journal
+            accounts = set()
             for journal in sub_journals:
-                credit_account = (journal.credit_account.id
-                    if journal.credit_account else None)
-                debit_account = (journal.debit_account.id
-                    if journal.debit_account else None)
-                clause = ((move.journal == journal.id)
-                    & (((line.credit != Null)
-                            & (line.account == credit_account))
-                        | ((line.debit != Null)
-                            & (line.account == debit_account))))
-                if accounts is None:
-                    accounts = clause
-                else:
-                    accounts |= clause
-
-            query = line.join(move, 'LEFT', condition=line.move == move.id
-                ).select(move.journal, Sum(line.debit), Sum(line.credit),
-                    where=where & red_sql & accounts,
+                for account in [journal.credit_account, journal.debit_account]:
+                    if account:
+                        accounts.add((journal.id, account.id))
+            if not accounts:
+                continue
+            mapping = Values(sorted(accounts))
+
+            if use_daily_total:
+                query = daily_total.join(mapping,
+                    condition=(mapping.column1 == daily_total.journal)
+                    & (mapping.column2 == daily_total.account)
+                    ).select(daily_total.journal,
+                    Sum(daily_total.debit), Sum(daily_total.credit),
+                    where=(daily_total.date >= context['start_date'])
+                    & (daily_total.date <= context['end_date']),
+                    group_by=daily_total.journal)
+            else:
+                query = line.join(move, condition=line.move == move.id
+                    ).join(mapping,
+                    condition=(mapping.column1 == move.journal)
+                    & (mapping.column2 == line.account)
+                    ).select(move.journal, Sum(line.debit), Sum(line.credit),
+                    where=(move.date >= context['start_date'])
+                    & (move.date <= context['end_date']),
                     group_by=move.journal)
             cursor.execute(*query)
             for journal_id, debit, credit in cursor.fetchall():
@@ -221,6 +233,149 @@ class Journal(ModelSQL, ModelView, CompanyMultiValueMixin):
         return result
 
 
+class JournalDailyTotal(ModelSQL):
+    '''
+    Journal Daily Total
+
+    It stores the sum of the move lines by journal, date and account.
+    It is maintained only if the "journal_daily_total" option of the
+    "account" section of the configuration file is set. Without the option
+    the table is emptied, so it is built again from the lines once the option
+    is set back.
+    '''
+    __name__ = 'account.journal.daily_total'
+    company = fields.Many2One('company.company', "Company", required=True,
+        ondelete='CASCADE')
+    journal = fields.Many2One('account.journal', "Journal", required=True,
+        ondelete='CASCADE')
+    date = fields.Date("Date", required=True)
+    account = fields.Many2One('account.account', "Account", required=True,
+        ondelete='CASCADE')
+    debit = fields.Numeric("Debit", required=True)
+    credit = fields.Numeric("Credit", required=True)
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        TableHandler = backend.get('TableHandler')
+
+        super(JournalDailyTotal, cls).__register__(module_name)
+
+        table = TableHandler(cls, module_name)
+        table.index_action(['journal', 'date'], 'add')
+
+        # Rebuild on update as the table is not maintained without the option
+        if cls.enabled():
+            if TableHandler.table_exist(Line._table):
+                cls._refresh(None)
+        else:
+            cls.clear()
+
+    @staticmethod
+    def enabled():
+        return config.getboolean('account', 'journal_daily_total',
+            default=False)
+
+    @classmethod
+    def built(cls):
+        '''
+        Test if the option is set and the table contains the totals of the
+        lines. It is empty when it has not been maintained.
+        '''
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        table = cls.__table__()
+        line = Line.__table__()
+        cursor = Transaction().connection.cursor()
+
+        if not cls.enabled():
+            return False
+        cursor.execute(*table.select(table.id, limit=1))
+        if cursor.fetchone():
+            return True
+        cursor.execute(*line.select(line.id, limit=1))
+        return not cursor.fetchone()
+
+    @classmethod
+    def clear(cls):
+        'Remove all the totals'
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(table.id, limit=1))
+        if cursor.fetchone():
+            cursor.execute(*table.delete())
+
+    @classmethod
+    def get_keys(cls, moves):
+        'Return the set of (journal, date) of the moves'
+        pool = Pool()
+        Move = pool.get('account.move')
+        move = Move.__table__()
+        cursor = Transaction().connection.cursor()
+
+        keys = set()
+        if not cls.enabled():
+            return keys
+        for sub_ids in grouped_slice([m.id for m in moves]):
+            cursor.execute(*move.select(move.journal, move.date,
+                    where=reduce_ids(move.id, sub_ids),
+                    group_by=[move.journal, move.date]))
+            keys.update(cursor.fetchall())
+        return keys
+
+    @classmethod
+    def refresh(cls, keys):
+        'Compute again the totals of the (journal, date) keys'
+        if not cls.enabled():
+            cls.clear()
+            return
+        elif not cls.built():
+            cls._refresh(None)
+            return
+        journal2dates = defaultdict(set)
+        for journal_id, date in keys:
+            journal2dates[journal_id].add(date)
+        for journal_id, dates in journal2dates.iteritems():
+            for sub_dates in grouped_slice(sorted(dates)):
+                cls._refresh((journal_id, list(sub_dates)))
+
+    @classmethod
+    def _refresh(cls, key):
+        '''
+        Replace the rows of the journal and dates of key by the sum of the
+        lines. If key is None, all the rows are replaced.
+        '''
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        table = cls.__table__()
+        line = Line.__table__()
+        move = Move.__table__()
+        cursor = Transaction().connection.cursor()
+
+        table_where = Literal(True)
+        move_where = Literal(True)
+        if key is not None:
+            journal_id, dates = key
+            table_where &= ((table.journal == journal_id)
+                & table.date.in_(dates))
+            move_where &= ((move.journal == journal_id)
+                & move.date.in_(dates))
+
+        cursor.execute(*table.delete(where=table_where))
+        cursor.execute(*table.insert([
+                    table.company, table.journal, table.date, table.account,
+                    table.debit, table.credit,
+                    ],
+                line.join(move, condition=line.move == move.id
+                    ).select(move.company, move.journal, move.date,
+                    line.account, Sum(line.debit), Sum(line.credit),
+                    where=move_where,
+                    group_by=[move.company, move.journal, move.date,
+                        line.account])))
+
+
 class JournalSequence(ModelSQL, CompanyValueMixin):
     "Journal Sequence"
     __name__ = 'account.journal.sequence'
@@ -320,6 +475,7 @@ class JournalPeriod(Workflow, ModelSQL, ModelView):
         ('open', 'Open'),
         ('close', 'Close'),
         ], 'State', readonly=True, required=True)
+    _states_cache = WeakKeyDictionary()
 
     @classmethod
     def __setup__(cls):
@@ -390,6 +546,55 @@ class JournalPeriod(Workflow, ModelSQL, ModelView):
             'close': 'tryton-close',
             }.get(self.state)
 
+    @classmethod
+    def get_states(cls, keys):
+        '''
+        Return a dictionary of the (journal id, period id) keys to the id and
+        state of the journal - periods. The missing ones are created.
+        The result is cached for the transaction.
+        '''
+        transaction = Transaction()
+        keys = set(keys)
+        cache = cls._states_cache.setdefault(transaction, {})
+        missing = keys - set(cache)
+        if missing:
+            cache.update(cls._read_states(missing))
+            missing -= set(cache)
+        if missing:
+            # Prevent the concurrent creation of the same journal - periods
+            transaction.database.lock(transaction.connection, cls._table)
+            cache.update(cls._read_states(missing))
+            missing -= set(cache)
+        if missing:
+            journal_periods = cls.create([{
+                        'journal': journal_id,
+                        'period': period_id,
+                        } for journal_id, period_id in sorted(missing)])
+            cache = cls._states_cache.setdefault(transaction, {})
+            cache.update(((p.journal.id, p.period.id), (p.id, p.state))
+                for p in journal_periods)
+            cache.update(cls._read_states(keys - set(cache)))
+        return dict((k, cache[k]) for k in keys)
+
+    @classmethod
+    def _read_states(cls, keys):
+        'Return the id and state of the existing journal - periods of keys'
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        journal_ids = {j for j, _ in keys}
+        period_ids = {p for _, p in keys}
+        result = {}
+        for sub_journal_ids in grouped_slice(journal_ids):
+            for sub_period_ids in grouped_slice(period_ids):
+                cursor.execute(*table.select(
+                        table.journal, table.period, table.id, table.state,
+                        where=reduce_ids(table.journal, sub_journal_ids)
+                        & reduce_ids(table.period, sub_period_ids)))
+                for journal_id, period_id, id_, state in cursor.fetchall():
+                    if (journal_id, period_id) in keys:
+                        result[journal_id, period_id] = (id_, state)
+        return result
+
     @classmethod
     def _check(cls, periods):
         Move = Pool().get('account.move')
@@ -411,6 +616,7 @@ class JournalPeriod(Workflow, ModelSQL, ModelView):
                 if period.state != 'open':
                     cls.raise_user_error('create_journal_period', (
                             period.rec_name,))
+        cls._states_cache.pop(Transaction(), None)
         return super(JournalPeriod, cls).create(vlist)
 
     @classmethod
@@ -427,11 +633,13 @@ class JournalPeriod(Workflow, ModelSQL, ModelView):
                                 'journal_period': journal_period.rec_name,
                                 'period': journal_period.period.rec_name,
                                 })
+        cls._states_cache.pop(Transaction(), None)
         super(JournalPeriod, cls).write(*args)
 
     @classmethod
     def delete(cls, periods):
         cls._check(periods)
+        cls._states_cache.pop(Transaction(), None)
         super(JournalPeriod, cls).delete(periods)
 
     @classmethod
@@ -0,0 +1,180 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import time
+from collections import defaultdict
+
+__all__ = ['ZeroSumMatcher']
+
+
+def _bits(mask):
+    "Return the number of bits set in mask"
+    return bin(mask).count('1')
+
+
+def _indices(mask):
+    "Return the list of indices of the bits set in mask"
+    indices = []
+    i = 0
+    while mask:
+        if mask & 1:
+            indices.append(i)
+        mask >>= 1
+        i += 1
+    return indices
+
+
+class ZeroSumMatcher(object):
+    '''
+    Find the largest subset of items whose integer amounts sum to zero.
+
+    items is a list of (key, amount) where amount is an integer of minor
+    units. If required is set, the subset must contain at least one of its
+    keys. The search stops after timeout seconds with the best subset found.
+    The strategies are tried in order and can be extended by subclasses.
+    '''
+    strategies = ['match_all', 'match_complement', 'match_pair',
+        'match_meet_in_the_middle', 'match_dynamic']
+    meet_in_the_middle_limit = 24
+    dynamic_state_limit = 100000
+
+    def __init__(self, items, required=None, timeout=None):
+        self.keys = [k for k, _ in items]
+        self.amounts = [a for _, a in items]
+        self.required_mask = 0
+        if required:
+            for i, key in enumerate(self.keys):
+                if key in required:
+                    self.required_mask |= 1 << i
+        self.required = bool(required)
+        self.all_mask = (1 << len(self.keys)) - 1
+        self.timeout = timeout
+        self._start = None
+
+    def match(self):
+        'Return the list of keys of the largest zero-sum subset'
+        self._start = time.time()
+        best = 0
+        for strategy in self.strategies:
+            if self.timed_out():
+                break
+            mask = getattr(self, strategy)()
+            if mask and _bits(mask) > _bits(best):
+                best = mask
+            if best == self.all_mask:
+                break
+        return [self.keys[i] for i in _indices(best)]
+
+    def timed_out(self):
+        return (self.timeout is not None
+            and time.time() - self._start > self.timeout)
+
+    def valid(self, mask):
+        'Test if the subset of mask can be returned'
+        if _bits(mask) < 2:
+            return False
+        return not self.required or bool(mask & self.required_mask)
+
+    def match_all(self):
+        'Match all the items if they sum to zero'
+        if sum(self.amounts) == 0 and self.valid(self.all_mask):
+            return self.all_mask
+
+    def match_complement(self):
+        'Match all the items but one or two whose amounts sum to the total'
+        total = sum(self.amounts)
+        amount2indices = defaultdict(list)
+        for i, amount in enumerate(self.amounts):
+            amount2indices[amount].append(i)
+        for i in amount2indices.get(total, []):
+            mask = self.all_mask & ~(1 << i)
+            if self.valid(mask):
+                return mask
+        for i, amount in enumerate(self.amounts):
+            for j in amount2indices.get(total - amount, []):
+                if j <= i:
+                    continue
+                mask = self.all_mask & ~((1 << i) | (1 << j))
+                if self.valid(mask):
+                    return mask
+
+    def match_pair(self):
+        'Match two items of opposite amounts'
+        amount2indices = defaultdict(list)
+        for i, amount in enumerate(self.amounts):
+            for j in amount2indices.get(-amount, []):
+                mask = (1 << i) | (1 << j)
+                if self.valid(mask):
+                    return mask
+            amount2indices[amount].append(i)
+
+    def _subsets(self, indices):
+        '''
+        Return a dictionary of the sums of the subsets of indices to the
+        largest subset and to the largest subset with a required item
+        '''
+        subsets = [(0, 0)]
+        for i in indices:
+            amount, bit = self.amounts[i], 1 << i
+            subsets += [(s + amount, m | bit) for s, m in subsets]
+        best = {}
+        for amount, mask in subsets:
+            largest, required = best.get(amount, (None, None))
+            if largest is None or _bits(mask) > _bits(largest):
+                largest = mask
+            if (mask & self.required_mask
+                    and (required is None or _bits(mask) > _bits(required))):
+                required = mask
+            best[amount] = (largest, required)
+        return best
+
+    def match_meet_in_the_middle(self):
+        'Match the largest subset by combining the subsets of two halves'
+        size = len(self.amounts)
+        if size > self.meet_in_the_middle_limit:
+            return
+        indices = range(size)
+        left = self._subsets(indices[:size // 2])
+        right = self._subsets(indices[size // 2:])
+        best = 0
+        for amount, (largest, required) in right.iteritems():
+            if -amount not in left:
+                continue
+            left_largest, left_required = left[-amount]
+            for right_mask, left_mask in [
+                    (largest, left_largest),
+                    (largest, left_required),
+                    (required, left_largest),
+                    ]:
+                if right_mask is None or left_mask is None:
+                    continue
+                mask = right_mask | left_mask
+                if self.valid(mask) and _bits(mask) > _bits(best):
+                    best = mask
+        return best
+
+    def match_dynamic(self):
+        '''
+        Match the largest subset by removing the smallest subset whose sum is
+        the total with a dynamic programming bounded in number of states
+        '''
+        total = sum(self.amounts)
+        states = {0: 0}
+        for i, amount in enumerate(self.amounts):
+            if self.timed_out():
+                break
+            bit = 1 << i
+            for state, mask in states.items():
+                new_state = state + amount
+                current = states.get(new_state)
+                if current is None or _bits(current) > _bits(mask) + 1:
+                    states[new_state] = mask | bit
+            if len(states) > self.dynamic_state_limit:
+                # Keep the states with the fewest items
+                states = dict(sorted(states.iteritems(),
+                        key=lambda s: _bits(s[1])
+                        )[:self.dynamic_state_limit])
+                states.setdefault(0, 0)
+        if total in states:
+            mask = self.all_mask & ~states[total]
+            if self.valid(mask):
+                return mask
@@ -2,15 +2,16 @@
 # this repository contains the full copyright notices and license terms.
 from decimal import Decimal
 import datetime
-from itertools import groupby, combinations
+from itertools import groupby
 from operator import itemgetter
 from collections import defaultdict
+from weakref import WeakKeyDictionary
 
-from sql import Null, Literal
-from sql.aggregate import Sum, Max
+from sql import Null, Literal, Values
+from sql.aggregate import Sum, Max, Min, Count
 from sql.conditionals import Coalesce, Case
 
-from trytond.model import ModelView, ModelSQL, fields, Check
+from trytond.model import ModelView, ModelSQL, fields, Check, Unique
 from trytond.wizard import Wizard, StateTransition, StateView, StateAction, \
     StateReport, Button
 from trytond.report import Report
@@ -21,9 +22,13 @@ from trytond.pool import Pool
 from trytond.rpc import RPC
 from trytond.tools import reduce_ids, grouped_slice
 from trytond.config import config
+from trytond.exceptions import UserError
 
-__all__ = ['Move', 'Reconciliation', 'Line', 'OpenJournalAsk',
-    'OpenJournal', 'OpenAccount',
+from .matching import ZeroSumMatcher
+
+__all__ = ['Move', 'Reconciliation', 'Line', 'LineOpenItem',
+    'LineReconcilePair',
+    'OpenJournalAsk', 'OpenJournal', 'OpenAccount',
     'ReconcileLinesWriteOff', 'ReconcileLines',
     'UnreconcileLines',
     'Reconcile', 'ReconcileShow',
@@ -40,6 +45,41 @@ _LINE_STATES = {
 _LINE_DEPENDS = ['state']
 
 
+class _ValidateMoveDataManager(object):
+    "Validate the queued moves before the commit of the transaction"
+
+    def __init__(self):
+        self.move_ids = set()
+        # The amounts of the moves before their modification by model
+        self.amount_move_ids = set()
+        self.amounts = defaultdict(dict)
+
+    def __eq__(self, other):
+        return isinstance(other, _ValidateMoveDataManager)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(_ValidateMoveDataManager)
+
+    def tpc_begin(self, trans):
+        pass
+
+    def commit(self, trans):
+        Move = Pool().get('account.move')
+        Move.flush_validate_move()
+
+    def tpc_vote(self, trans):
+        pass
+
+    def tpc_finish(self, trans):
+        pass
+
+    def tpc_abort(self, trans):
+        pass
+
+
 class Move(ModelSQL, ModelView):
     'Account Move'
     __name__ = 'account.move'
@@ -233,8 +273,14 @@ class Move(ModelSQL, ModelView):
 
     @classmethod
     def write(cls, *args):
+        pool = Pool()
+        DailyTotal = pool.get('account.journal.daily_total')
+        Line = pool.get('account.move.line')
         actions = iter(args)
         all_moves = []
+        period_moves = []
+        sync_moves = []
+        total_keys = set()
         args = []
         for moves, values in zip(actions, actions):
             keys = values.keys()
@@ -243,10 +289,21 @@ class Move(ModelSQL, ModelView):
                     keys.remove(key)
             if len(keys):
                 cls.check_modify(moves)
+            if {'period', 'company', 'state'} & set(values.keys()):
+                period_moves.extend(moves)
+            if {'journal', 'date'} & set(values.keys()):
+                total_keys.update(DailyTotal.get_keys(moves))
+            if {'period', 'date', 'company'} & set(values.keys()):
+                sync_moves.extend(moves)
             args.extend((moves, values))
             all_moves.extend(moves)
+        cls.queue_amounts(period_moves)
         super(Move, cls).write(*args)
-        cls.validate_move(all_moves)
+        if sync_moves:
+            Line.sync_move_fields(sync_moves)
+        cls.queue_validate_move(all_moves)
+        if total_keys:
+            DailyTotal.refresh(total_keys - DailyTotal.get_keys(all_moves))
 
     @classmethod
     def create(cls, vlist):
@@ -255,16 +312,21 @@ class Move(ModelSQL, ModelView):
         Journal = pool.get('account.journal')
 
         vlist = [x.copy() for x in vlist]
+        sequence2vals = defaultdict(list)
         for vals in vlist:
             if not vals.get('number'):
                 journal_id = (vals.get('journal')
                         or Transaction().context.get('journal'))
                 if journal_id:
                     journal = Journal(journal_id)
-                    vals['number'] = Sequence.get_id(journal.sequence.id)
+                    sequence2vals[journal.sequence.id].append(vals)
+        for sequence_id, sequence_vlist in sequence2vals.iteritems():
+            numbers = Sequence.get_ids(sequence_id, len(sequence_vlist))
+            for vals, number in zip(sequence_vlist, numbers):
+                vals['number'] = number
 
         moves = super(Move, cls).create(vlist)
-        cls.validate_move(moves)
+        cls.queue_validate_move(moves)
         return moves
 
     @classmethod
@@ -296,6 +358,65 @@ class Move(ModelSQL, ModelView):
             new_moves.append(new_move)
         return new_moves
 
+    @classmethod
+    def queue_validate_move(cls, moves):
+        '''
+        Queue the moves to be validated once before the commit of the
+        transaction or before the lines are read
+        '''
+        if not moves:
+            return
+        datamanager = Transaction().join(_ValidateMoveDataManager())
+        datamanager.move_ids.update(m.id for m in moves)
+
+    @classmethod
+    def flush_validate_move(cls):
+        'Validate the queued moves'
+        transaction = Transaction()
+        datamanager = transaction.join(_ValidateMoveDataManager())
+        if not datamanager.move_ids:
+            return
+        move_ids = list(datamanager.move_ids)
+        datamanager.move_ids.clear()
+        table = cls.__table__()
+        cursor = transaction.connection.cursor()
+        existing_ids = []
+        for sub_ids in grouped_slice(move_ids):
+            cursor.execute(*table.select(table.id,
+                    where=reduce_ids(table.id, sub_ids)))
+            existing_ids.extend(i for i, in cursor.fetchall())
+        cls.validate_move(cls.browse(existing_ids))
+
+    @classmethod
+    def _get_amount_models(cls):
+        '''
+        Return the models which store amounts of the move lines with the
+        methods get_amounts and update_amounts
+        '''
+        return ['account.account.period_balance',
+            'account.move.line.reconcile_pair']
+
+    @classmethod
+    def queue_amounts(cls, moves):
+        '''
+        Store the amounts of the moves before they are modified to update the
+        amount models when the moves are validated
+        '''
+        pool = Pool()
+        datamanager = Transaction().join(_ValidateMoveDataManager())
+        moves = [m for m in moves if m.id not in datamanager.amount_move_ids]
+        if not moves:
+            return
+        for name in cls._get_amount_models():
+            Model = pool.get(name)
+            model_amounts = datamanager.amounts[name]
+            for key, amounts in Model.get_amounts(moves).iteritems():
+                if key in model_amounts:
+                    amounts = tuple(
+                        a + b for a, b in zip(model_amounts[key], amounts))
+                model_amounts[key] = amounts
+        datamanager.amount_move_ids.update(m.id for m in moves)
+
     @classmethod
     def validate_move(cls, moves):
         '''
@@ -303,26 +424,25 @@ class Move(ModelSQL, ModelView):
         '''
         pool = Pool()
         MoveLine = pool.get('account.move.line')
+        OpenItem = pool.get('account.move.line.open_item')
+        DailyTotal = pool.get('account.journal.daily_total')
         line = MoveLine.__table__()
 
         cursor = Transaction().connection.cursor()
 
         amounts = {}
-        move2draft_lines = {}
+        draft_counts = {}
         for sub_move_ids in grouped_slice([m.id for m in moves]):
             red_sql = reduce_ids(line.move, sub_move_ids)
 
             cursor.execute(*line.select(line.move,
                     Sum(line.debit - line.credit),
+                    Sum(Case((line.state == 'draft', 1), else_=0)),
                     where=red_sql,
                     group_by=line.move))
-            amounts.update(dict(cursor.fetchall()))
-
-            cursor.execute(*line.select(line.move, line.id,
-                    where=red_sql & (line.state == 'draft'),
-                    order_by=line.move))
-            move2draft_lines.update(dict((k, [j[1] for j in g])
-                    for k, g in groupby(cursor.fetchall(), itemgetter(0))))
+            for move_id, amount, draft_count in cursor.fetchall():
+                amounts[move_id] = amount
+                draft_counts[move_id] = draft_count
 
         valid_moves = []
         draft_moves = []
@@ -333,13 +453,19 @@ class Move(ModelSQL, ModelView):
             # SQLite uses float for SUM
             if not isinstance(amount, Decimal):
                 amount = Decimal(amount)
-            draft_lines = MoveLine.browse(move2draft_lines.get(move.id, []))
             if not move.company.currency.is_zero(amount):
                 draft_moves.append(move.id)
                 continue
-            if not draft_lines:
+            if not draft_counts[move.id]:
                 continue
             valid_moves.append(move.id)
+        # The state of the lines is going to change
+        cls.queue_amounts(cls.browse(valid_moves + draft_moves))
+        datamanager = Transaction().join(_ValidateMoveDataManager())
+        amount_moves = cls.browse(list(datamanager.amount_move_ids))
+        old_amounts = datamanager.amounts
+        datamanager.amount_move_ids = set()
+        datamanager.amounts = defaultdict(dict)
         for move_ids, state in (
                 (valid_moves, 'valid'),
                 (draft_moves, 'draft'),
@@ -352,6 +478,12 @@ class Move(ModelSQL, ModelView):
                             columns=[line.state],
                             values=[state],
                             where=red_sql))
+        for name in cls._get_amount_models():
+            Model = pool.get(name)
+            Model.update_amounts(
+                old_amounts[name], Model.get_amounts(amount_moves))
+        OpenItem.refresh(moves)
+        DailyTotal.refresh(DailyTotal.get_keys(moves))
 
     def _cancel_default(self):
         'Return default dictionary to cancel move'
@@ -398,33 +530,85 @@ class Move(ModelSQL, ModelView):
         Sequence = pool.get('ir.sequence')
         Date = pool.get('ir.date')
         Line = pool.get('account.move.line')
+        Account = pool.get('account.account')
+        Reconciliation = pool.get('account.move.reconciliation')
+        table = cls.__table__()
+        line = Line.__table__()
+        account = Account.__table__()
+        cursor = Transaction().connection.cursor()
+
+        amounts = {}
+        zero_lines = []
+        for sub_moves in grouped_slice(moves):
+            red_sql = reduce_ids(line.move, [m.id for m in sub_moves])
+            cursor.execute(*line.select(line.move,
+                    Sum(line.debit - line.credit),
+                    where=red_sql,
+                    group_by=line.move))
+            amounts.update(cursor.fetchall())
+
+            # The amounts are tested in Python as SQLite stores Numeric as
+            # BLOB which can not be compared to 0
+            cursor.execute(*line.join(account,
+                    condition=line.account == account.id
+                    ).select(line.id, line.move, line.party, line.account,
+                    line.date, line.reconciliation, line.debit, line.credit,
+                    where=red_sql & (account.reconcile == True),
+                    order_by=[line.move, line.party, line.account, line.id]))
+            zero_lines.extend(l[:6] for l in cursor.fetchall()
+                if not Decimal(str(l[6])) and not Decimal(str(l[7])))
 
         for move in moves:
-            amount = Decimal('0.0')
-            if not move.lines:
+            if move.id not in amounts:
                 cls.raise_user_error('post_empty_move', (move.rec_name,))
-            company = None
-            for line in move.lines:
-                amount += line.debit - line.credit
-                if not company:
-                    company = line.account.company
-            if not company.currency.is_zero(amount):
+            amount = amounts[move.id]
+            # SQLite uses float for SUM
+            if not isinstance(amount, Decimal):
+                amount = Decimal(str(amount))
+            if not move.company.currency.is_zero(amount):
                 cls.raise_user_error('post_unbalanced_move', (move.rec_name,))
+
+        post_date = Date.today()
+        sequence2moves = defaultdict(list)
         for move in moves:
             move.state = 'posted'
             if not move.post_number:
-                move.post_date = Date.today()
-                move.post_number = Sequence.get_id(
-                    move.period.post_move_sequence_used.id)
+                move.post_date = post_date
+                sequence2moves[move.period.post_move_sequence_used.id].append(
+                    move)
+        numbers = {}
+        for sequence_id, sequence_moves in sequence2moves.iteritems():
+            for move, number in zip(sequence_moves,
+                    Sequence.get_ids(sequence_id, len(sequence_moves))):
+                move.post_number = number
+                numbers[move.id] = number
+        # Number before writing the state which cleans the cache of the moves
+        for sub_ids in grouped_slice(sorted(numbers)):
+            sub_ids = list(sub_ids)
+            cursor.execute(*table.update(
+                    [table.post_number, table.post_date],
+                    [Case(*((table.id == i, numbers[i]) for i in sub_ids)),
+                        post_date],
+                    where=reduce_ids(table.id, sub_ids)))
+
+        # Reconcile the zero lines of each move by party and account
+        to_reconcile = []
+        for _, group in groupby(zero_lines, key=itemgetter(1, 2, 3)):
+            group = list(group)
+            for line_id, _, _, _, _, reconciliation in group:
+                if reconciliation:
+                    zero_line = Line(line_id)
+                    Line.raise_user_error('already_reconciled',
+                        error_args=(zero_line.move.number, zero_line.id,))
+            to_reconcile.append({
+                    'lines': [('add', [l[0] for l in group])],
+                    'date': max(l[4] for l in group),
+                    })
+        if to_reconcile:
+            Reconciliation.create(to_reconcile)
 
-            keyfunc = lambda l: (l.party, l.account)
-            to_reconcile = [l for l in move.lines
-                if ((l.debit == l.credit == Decimal('0'))
-                    and l.account.reconcile)]
-            to_reconcile = sorted(to_reconcile, key=keyfunc)
-            for _, zero_lines in groupby(to_reconcile, keyfunc):
-                Line.reconcile(list(zero_lines))
-        cls.save(moves)
+        # Write fresh instances as the given ones are already posted
+        cls.write(cls.browse([m.id for m in moves]), {'state': 'posted'})
 
 
 class Reconciliation(ModelSQL, ModelView):
@@ -501,6 +685,17 @@ class Reconciliation(ModelSQL, ModelView):
     def write(cls, moves, values, *args):
         cls.raise_user_error('modify')
 
+    @classmethod
+    def delete(cls, reconciliations):
+        pool = Pool()
+        Move = pool.get('account.move')
+        OpenItem = pool.get('account.move.line.open_item')
+        moves = list({l.move for r in reconciliations for l in r.lines})
+        Move.queue_amounts(moves)
+        super(Reconciliation, cls).delete(reconciliations)
+        OpenItem.refresh(moves)
+        Move.queue_validate_move(moves)
+
     @classmethod
     def validate(cls, reconciliations):
         super(Reconciliation, cls).validate(reconciliations)
@@ -508,8 +703,50 @@ class Reconciliation(ModelSQL, ModelView):
 
     @classmethod
     def check_lines(cls, reconciliations):
-        Lang = Pool().get('ir.lang')
+        pool = Pool()
+        Lang = pool.get('ir.lang')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+        Account = pool.get('account.account')
+        line = Line.__table__()
+        account = Account.__table__()
+        cursor = Transaction().connection.cursor()
+
+        Move.flush_validate_move()
+        failed = set()
+        for sub_ids in grouped_slice([r.id for r in reconciliations]):
+            cursor.execute(*line.join(account,
+                    condition=line.account == account.id
+                    ).select(line.reconciliation,
+                    Sum(Case((line.state != 'valid', 1), else_=0)),
+                    Count(line.account, distinct=True),
+                    Min(line.account),
+                    Sum(Case((account.reconcile, 0), else_=1)),
+                    Count(line.party, distinct=True),
+                    Sum(Case((line.party == Null, 1), else_=0)),
+                    Sum(line.debit - line.credit),
+                    where=reduce_ids(line.reconciliation, sub_ids),
+                    group_by=line.reconciliation))
+            for (reconciliation_id, not_valid, accounts, account_id,
+                    not_reconcile, parties, no_party,
+                    balance) in cursor.fetchall():
+                if (not_valid or accounts != 1 or not_reconcile
+                        or parties > 1 or (parties and no_party)):
+                    failed.add(reconciliation_id)
+                    continue
+                # SQLite uses float for SUM
+                if not isinstance(balance, Decimal):
+                    balance = Decimal(str(balance))
+                if balance:
+                    currency = Account(account_id).company.currency
+                    if not currency.is_zero(balance):
+                        failed.add(reconciliation_id)
+
+        # Check line by line only the failing reconciliations to build the
+        # error message
         for reconciliation in reconciliations:
+            if reconciliation.id not in failed:
+                continue
             debit = Decimal('0.0')
             credit = Decimal('0.0')
             account = None
@@ -583,14 +820,16 @@ class Line(ModelSQL, ModelView):
             states=_states, depends=_depends),
             'get_move_field', setter='set_move_field',
             searcher='search_move_field')
-    period = fields.Function(fields.Many2One('account.period', 'Period',
-            states=_states, depends=_depends),
-            'get_move_field', setter='set_move_field',
-            searcher='search_move_field')
-    date = fields.Function(fields.Date('Effective Date', required=True,
-            states=_states, depends=_depends),
-            'get_move_field', setter='set_move_field',
-            searcher='search_move_field')
+    # The period, date, fiscal year and company are copied from the move
+    # to filter the lines without joining the move
+    period = fields.Many2One('account.period', 'Period', required=True,
+        select=True, states=_states, depends=_depends)
+    date = fields.Date('Effective Date', required=True, select=True,
+        states=_states, depends=_depends)
+    fiscalyear = fields.Many2One('account.fiscalyear', 'Fiscal Year',
+        required=True, readonly=True, select=True)
+    company = fields.Many2One('company.company', 'Company', required=True,
+        readonly=True, select=True)
     origin = fields.Function(fields.Reference('Origin',
             selection='get_origin'),
         'get_move_field', searcher='search_move_field')
@@ -663,6 +902,7 @@ class Line(ModelSQL, ModelView):
             'Amount Currency Digits'), 'get_amount_currency')
 
     del _states, _depends
+    _query_get_cache = WeakKeyDictionary()
 
     @classmethod
     def __setup__(cls):
@@ -706,17 +946,34 @@ class Line(ModelSQL, ModelView):
     @classmethod
     def __register__(cls, module_name):
         TableHandler = backend.get('TableHandler')
+        exist = TableHandler.table_exist(cls._table)
         table = TableHandler(cls, module_name)
 
         # Migration from 2.4: reference renamed into description
         if table.column_exist('reference'):
             table.column_rename('reference', 'description')
 
+        # Migration from 4.6: copy move fields
+        copy_move_fields = exist and not table.column_exist('fiscalyear')
+
         super(Line, cls).__register__(module_name)
 
         table = TableHandler(cls, module_name)
+        if copy_move_fields:
+            cls.sync_move_fields(None)
+            for field_name in ['period', 'date', 'fiscalyear', 'company']:
+                table.not_null_action(field_name, action='add')
         # Index for General Ledger
         table.index_action(['move', 'account'], 'add')
+        # Index for reconciliation
+        if backend.name() in ('postgresql', 'sqlite'):
+            cursor = Transaction().connection.cursor()
+            cursor.execute('CREATE INDEX IF NOT EXISTS "%s" ON "%s" '
+                '("account", "party") WHERE "reconciliation" IS NULL'
+                % (cls._table + '_account_party_unreconciled_index',
+                    cls._table))
+        else:
+            table.index_action(['account', 'party', 'reconciliation'], 'add')
 
         # Migration from 1.2
         table.not_null_action('blocked', action='remove')
@@ -726,6 +983,10 @@ class Line(ModelSQL, ModelView):
         table.not_null_action('active', action='remove')
         table.index_action('active', action='remove')
 
+    @staticmethod
+    def default_period():
+        return Transaction().context.get('period')
+
     @classmethod
     def default_date(cls):
         '''
@@ -758,7 +1019,7 @@ class Line(ModelSQL, ModelView):
         if context.get('journal') and context.get('period'):
             lines = cls.search([
                     ('move.journal', '=', context['journal']),
-                    ('move.period', '=', context['period']),
+                    ('period', '=', context['period']),
                     ('create_uid', '=', transaction.user),
                     ('state', '=', 'draft'),
                     ], order=[('id', 'DESC')], limit=1)
@@ -887,6 +1148,41 @@ class Line(ModelSQL, ModelView):
         if self.move:
             return self.move.state
 
+    @classmethod
+    def sync_move_fields(cls, moves):
+        '''
+        Copy the period, date, fiscal year and company of the moves to their
+        lines. If moves is None, all the lines are updated.
+        '''
+        pool = Pool()
+        Move = pool.get('account.move')
+        Period = pool.get('account.period')
+        line = cls.__table__()
+        move = Move.__table__()
+        period = Period.__table__()
+        cursor = Transaction().connection.cursor()
+
+        def update(where=None):
+            cursor.execute(*line.update(
+                    columns=[line.period, line.date, line.fiscalyear,
+                        line.company],
+                    values=[
+                        move.select(move.period, where=move.id == line.move),
+                        move.select(move.date, where=move.id == line.move),
+                        move.join(period,
+                            condition=move.period == period.id
+                            ).select(period.fiscalyear,
+                            where=move.id == line.move),
+                        move.select(move.company, where=move.id == line.move),
+                        ],
+                    where=where))
+
+        if moves is None:
+            update()
+        else:
+            for sub_ids in grouped_slice([m.id for m in moves]):
+                update(reduce_ids(line.move, sub_ids))
+
     def _order_move_field(name):
         def order_field(tables):
             pool = Pool()
@@ -903,8 +1199,6 @@ class Line(ModelSQL, ModelView):
             return field.convert_order(name, move_tables, Move)
         return staticmethod(order_field)
     order_journal = _order_move_field('journal')
-    order_period = _order_move_field('period')
-    order_date = _order_move_field('date')
     order_origin = _order_move_field('origin')
     order_move_state = _order_move_field('state')
 
@@ -943,20 +1237,54 @@ class Line(ModelSQL, ModelView):
         table is the SQL instance of account.move.line table
         '''
         pool = Pool()
-        FiscalYear = pool.get('account.fiscalyear')
         Move = pool.get('account.move')
-        Period = pool.get('account.period')
-        move = Move.__table__()
-        period = Period.__table__()
-        fiscalyear = FiscalYear.__table__()
-        context = Transaction().context
-        company = context.get('company')
+        transaction = Transaction()
+        context = transaction.context
 
-        fiscalyear_ids = []
-        where = Literal(True)
+        # The state of the lines must be up to date
+        Move.flush_validate_move()
 
+        date = context.get('date')
+        from_date, to_date = context.get('from_date'), context.get('to_date')
+        fiscalyear_id = context.get('fiscalyear')
+        period_ids = context.get('periods')
+        key = (transaction.user, context.get('company'), date, fiscalyear_id,
+            tuple(period_ids) if period_ids is not None else None,
+            from_date, to_date)
+        cache = cls._query_get_cache.setdefault(transaction, {})
+        if key not in cache:
+            cache[key] = cls._query_get_fiscalyear_ids()
+        fiscalyear_ids = cache[key]
+
+        where = table.state != 'draft'
         if context.get('posted'):
-            where &= move.state == 'posted'
+            move = Move.__table__()
+            where &= table.move.in_(move.select(move.id,
+                    where=move.state == 'posted'))
+
+        if date:
+            where &= reduce_ids(table.fiscalyear, fiscalyear_ids)
+            where &= table.date <= date
+        elif fiscalyear_id or period_ids or from_date or to_date:
+            if fiscalyear_id:
+                where &= table.fiscalyear == fiscalyear_id
+            if period_ids:
+                where &= table.period.in_(period_ids)
+            if from_date:
+                where &= table.date >= from_date
+            if to_date:
+                where &= table.date <= to_date
+        else:
+            where &= reduce_ids(table.fiscalyear, fiscalyear_ids)
+        return where, list(fiscalyear_ids)
+
+    @classmethod
+    def _query_get_fiscalyear_ids(cls):
+        'Return the fiscal year ids depending of the context'
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        context = Transaction().context
+        company = context.get('company')
 
         date = context.get('date')
         from_date, to_date = context.get('from_date'), context.get('to_date')
@@ -968,41 +1296,36 @@ class Line(ModelSQL, ModelView):
                     ('end_date', '>=', date),
                     ('company', '=', company),
                     ], limit=1)
-            if fiscalyears:
-                fiscalyear_id = fiscalyears[0].id
-            else:
-                fiscalyear_id = -1
-            fiscalyear_ids = map(int, fiscalyears)
-            where &= period.fiscalyear == fiscalyear_id
-            where &= move.date <= date
+            return map(int, fiscalyears)
         elif fiscalyear_id or period_ids or from_date or to_date:
             if fiscalyear_id:
-                fiscalyear_ids = [fiscalyear_id]
-                where &= fiscalyear.id == fiscalyear_id
-            if period_ids:
-                where &= move.period.in_(period_ids)
-            if from_date:
-                where &= move.date >= from_date
-            if to_date:
-                where &= move.date <= to_date
+                return [fiscalyear_id]
+            return []
         else:
-            where &= fiscalyear.state == 'open'
-            where &= fiscalyear.company == company
             fiscalyears = FiscalYear.search([
                     ('state', '=', 'open'),
                     ('company', '=', company),
                     ])
-            fiscalyear_ids = map(int, fiscalyears)
+            return map(int, fiscalyears)
 
-        # Use LEFT JOIN to allow database optimization
-        # if no joined table is used in the where clause.
-        return ((table.state != 'draft')
-            & table.move.in_(move
-                .join(period, 'LEFT', condition=move.period == period.id)
-                .join(fiscalyear, 'LEFT',
-                    condition=period.fiscalyear == fiscalyear.id)
-                .select(move.id, where=where)),
-            fiscalyear_ids)
+    @classmethod
+    def clear_query_get_cache(cls):
+        'Clear the cached queries of query_get for the transaction'
+        cls._query_get_cache.pop(Transaction(), None)
+
+    @classmethod
+    def read(cls, ids, fields_names=None):
+        Move = Pool().get('account.move')
+        Move.flush_validate_move()
+        return super(Line, cls).read(ids, fields_names=fields_names)
+
+    @classmethod
+    def search(cls, domain, offset=0, limit=None, order=None, count=False,
+            query=False):
+        Move = Pool().get('account.move')
+        Move.flush_validate_move()
+        return super(Line, cls).search(domain, offset=offset, limit=limit,
+            order=order, count=count, query=query)
 
     @classmethod
     def on_write(cls, lines):
@@ -1031,21 +1354,21 @@ class Line(ModelSQL, ModelView):
         Check if the lines can be modified or created for the journal - period
         and if there is no journal - period, create it
         '''
+        cls.check_journal_periods_modify([(journal.id, period.id)])
+
+    @classmethod
+    def check_journal_periods_modify(cls, keys):
+        '''
+        Check if the lines can be modified or created for the
+        (journal id, period id) keys and create the missing journal - periods
+        '''
         JournalPeriod = Pool().get('account.journal.period')
-        journal_periods = JournalPeriod.search([
-                ('journal', '=', journal.id),
-                ('period', '=', period.id),
-                ], limit=1)
-        if journal_periods:
-            journal_period, = journal_periods
-            if journal_period.state == 'close':
+        states = JournalPeriod.get_states(keys)
+        for key in sorted(set(keys)):
+            journal_period_id, state = states[key]
+            if state == 'close':
                 cls.raise_user_error('add_modify_closed_journal_period', (
-                        journal_period.rec_name,))
-        else:
-            JournalPeriod.create([{
-                        'journal': journal.id,
-                        'period': period.id,
-                        }])
+                        JournalPeriod(journal_period_id).rec_name,))
 
     @classmethod
     def check_modify(cls, lines, modified_fields=None):
@@ -1055,16 +1378,13 @@ class Line(ModelSQL, ModelView):
         if (modified_fields is not None
                 and modified_fields <= cls._check_modify_exclude):
             return
-        journal_period_done = []
+        journal_periods = set()
         for line in lines:
             if line.move.state == 'posted':
                 cls.raise_user_error('modify_posted_move', (
                         line.move.rec_name,))
-            journal_period = (line.journal.id, line.period.id)
-            if journal_period not in journal_period_done:
-                cls.check_journal_period_modify(line.period,
-                        line.journal)
-                journal_period_done.append(journal_period)
+            journal_periods.add((line.move.journal.id, line.period.id))
+        cls.check_journal_periods_modify(journal_periods)
 
     @classmethod
     def check_reconciliation(cls, lines, modified_fields=None):
@@ -1077,32 +1397,67 @@ class Line(ModelSQL, ModelView):
 
     @classmethod
     def delete(cls, lines):
-        Move = Pool().get('account.move')
+        pool = Pool()
+        Move = pool.get('account.move')
+        PartyBalance = pool.get('party.party.balance')
         cls.check_modify(lines)
         cls.check_reconciliation(lines)
         moves = [x.move for x in lines]
+        # The open items are deleted by cascade without refreshing the
+        # balances of their parties
+        party_ids = {x.party.id for x in lines if x.party}
+        Move.queue_amounts(moves)
         super(Line, cls).delete(lines)
-        Move.validate_move(moves)
+        PartyBalance.refresh(party_ids)
+        Move.queue_validate_move(moves)
 
     @classmethod
     def write(cls, *args):
-        Move = Pool().get('account.move')
+        pool = Pool()
+        Move = pool.get('account.move')
 
         actions = iter(args)
         args = []
         moves = []
         all_lines = []
+        amount_moves = []
+        sync_lines = []
+        to_write = []
         for lines, values in zip(actions, actions):
             cls.check_modify(lines, set(values.keys()))
             cls.check_reconciliation(lines, set(values.keys()))
             moves.extend((x.move for x in lines))
             all_lines.extend(lines)
+            if ({'account', 'move', 'party', 'debit', 'credit',
+                        'amount_second_currency', 'state', 'reconciliation'}
+                    & set(values.keys())):
+                amount_moves.extend(l.move for l in lines)
+                if values.get('move'):
+                    amount_moves.append(Move(values['move']))
+            if 'move' in values:
+                sync_lines.extend(lines)
+            values = values.copy()
+            # The period and date are written on the moves
+            move_values = {}
+            for name in ['period', 'date']:
+                value = values.pop(name, None)
+                if value:
+                    move_values[name] = value
+            if move_values:
+                to_write.extend(
+                    (list({l.move for l in lines}), move_values))
             args.extend((lines, values))
 
+        Move.queue_amounts(amount_moves)
         super(Line, cls).write(*args)
+        if to_write:
+            Move.write(*to_write)
 
         Transaction().timestamp = {}
-        Move.validate_move(list(set(l.move for l in all_lines) | set(moves)))
+        moves = list(set(l.move for l in all_lines) | set(moves))
+        if sync_lines:
+            cls.sync_move_fields(list({l.move for l in sync_lines}))
+        Move.queue_validate_move(moves)
 
     @classmethod
     def create(cls, vlist):
@@ -1118,21 +1473,39 @@ class Line(ModelSQL, ModelView):
                     cls.raise_user_error('no_journal')
                 if move is None:
                     move = Move()
-                    move.period = vals.get('period',
-                        Transaction().context.get('period'))
+                    move.period = (vals.get('period')
+                        or Transaction().context.get('period'))
                     move.journal = journal_id
                     move.date = vals.get('date')
                     move.save()
                 vals['move'] = move.id
-            else:
-                # prevent computation of default date
-                vals.setdefault('date', None)
+        moves = dict((m.id, m)
+            for m in Move.browse(list({v['move'] for v in vlist})))
+        # The period and date are written on the move
+        to_write = defaultdict(dict)
+        for vals in vlist:
+            move = moves[vals['move']]
+            if vals.get('period') and vals['period'] != move.period.id:
+                to_write[move]['period'] = vals['period']
+            if vals.get('date') and vals['date'] != move.date:
+                to_write[move]['date'] = vals['date']
+        if to_write:
+            args = []
+            for move, values in to_write.iteritems():
+                args.extend(([move], values))
+            Move.write(*args)
+            moves = dict((m.id, m) for m in Move.browse(moves.keys()))
+        for vals in vlist:
+            move = moves[vals['move']]
+            vals['period'] = move.period.id
+            vals['date'] = move.date
+            vals['fiscalyear'] = move.period.fiscalyear.id
+            vals['company'] = move.company.id
+        Move.queue_amounts(moves.values())
         lines = super(Line, cls).create(vlist)
-        period_and_journals = set((line.period, line.journal)
-            for line in lines)
-        for period, journal in period_and_journals:
-            cls.check_journal_period_modify(period, journal)
-        Move.validate_move(list(set(line.move for line in lines)))
+        cls.check_journal_periods_modify(
+            {(m.journal.id, m.period.id) for m in moves.itervalues()})
+        Move.queue_validate_move(list(set(line.move for line in lines)))
         return lines
 
     @classmethod
@@ -1143,6 +1516,9 @@ class Line(ModelSQL, ModelView):
             default['move'] = None
         if 'reconciliation' not in default:
             default['reconciliation'] = None
+        # The move fields are copied from the move
+        for name in ['period', 'date', 'fiscalyear', 'company']:
+            default.setdefault(name, None)
         return super(Line, cls).copy(lines, default=default)
 
     @classmethod
@@ -1176,76 +1552,362 @@ class Line(ModelSQL, ModelView):
     @classmethod
     def reconcile(cls, lines, journal=None, date=None, account=None,
             description=None):
+        reconciliation, = cls.reconcile_many([lines], journal=journal,
+            date=date, account=account, description=description)
+        return reconciliation
+
+    @classmethod
+    def reconcile_many(cls, groups, journal=None, date=None, account=None,
+            description=None):
+        'Reconcile each group of lines and return the reconciliations'
         pool = Pool()
         Move = pool.get('account.move')
         Reconciliation = pool.get('account.move.reconciliation')
         Period = pool.get('account.period')
         Date = pool.get('ir.date')
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
 
-        for line in lines:
-            if line.reconciliation:
-                cls.raise_user_error('already_reconciled',
-                        error_args=(line.move.number, line.id,))
-
-        lines = list(lines)
-        reconcile_account = None
-        reconcile_party = None
-        amount = Decimal('0.0')
-        for line in lines:
-            amount += line.debit - line.credit
-            if not reconcile_account:
-                reconcile_account = line.account
-            if not reconcile_party:
-                reconcile_party = line.party
-        amount = reconcile_account.currency.round(amount)
-        if not account and journal:
-            if amount >= 0:
-                account = journal.debit_account
-            else:
-                account = journal.credit_account
-        if journal and account:
+        groups = [list(lines) for lines in groups]
+        reconciled = set()
+        for sub_ids in grouped_slice(
+                [l.id for lines in groups for l in lines]):
+            cursor.execute(*table.select(table.id,
+                    where=reduce_ids(table.id, sub_ids)
+                    & (table.reconciliation != Null)))
+            reconciled.update(i for i, in cursor.fetchall())
+        for lines in groups:
+            for line in lines:
+                if line.id in reconciled:
+                    cls.raise_user_error('already_reconciled',
+                            error_args=(line.move.number, line.id,))
+
+        to_writeoff = []
+        move_vlist = []
+        for lines in groups:
+            reconcile_account = None
+            reconcile_party = None
+            amount = Decimal('0.0')
+            for line in lines:
+                amount += line.debit - line.credit
+                if not reconcile_account:
+                    reconcile_account = line.account
+                if not reconcile_party:
+                    reconcile_party = line.party
+            amount = reconcile_account.currency.round(amount)
+            writeoff_account = account
+            if not writeoff_account and journal:
+                if amount >= 0:
+                    writeoff_account = journal.debit_account
+                else:
+                    writeoff_account = journal.credit_account
+            if not (journal and writeoff_account):
+                continue
             if not date:
                 date = Date.today()
             period_id = Period.find(reconcile_account.company.id, date=date)
-            move, = Move.create([{
-                        'journal': journal.id,
-                        'period': period_id,
-                        'date': date,
-                        'description': description,
-                        'lines': [
-                            ('create', [{
-                                        'account': reconcile_account.id,
-                                        'party': (reconcile_party.id
-                                            if reconcile_party else None),
-                                        'debit': (amount < Decimal('0.0')
-                                            and - amount or Decimal('0.0')),
-                                        'credit': (amount > Decimal('0.0')
-                                            and amount or Decimal('0.0')),
-                                        }, {
-                                        'account': account.id,
-                                        'party': (reconcile_party.id
-                                            if (account.party_required and
-                                                reconcile_party)
-                                            else None),
-                                        'debit': (amount > Decimal('0.0')
-                                            and amount or Decimal('0.0')),
-                                        'credit': (amount < Decimal('0.0')
-                                            and - amount or Decimal('0.0')),
-                                        }]),
-                            ],
-                        }])
-            lines += cls.search([
-                    ('move', '=', move.id),
-                    ('account', '=', reconcile_account.id),
-                    ('debit', '=', amount < Decimal('0.0') and - amount
-                        or Decimal('0.0')),
-                    ('credit', '=', amount > Decimal('0.0') and amount
-                        or Decimal('0.0')),
-                    ], limit=1)
+            debit = amount < Decimal('0.0') and - amount or Decimal('0.0')
+            credit = amount > Decimal('0.0') and amount or Decimal('0.0')
+            to_writeoff.append((lines, reconcile_account, debit, credit))
+            move_vlist.append({
+                    'journal': journal.id,
+                    'period': period_id,
+                    'date': date,
+                    'description': description,
+                    'lines': [
+                        ('create', [{
+                                    'account': reconcile_account.id,
+                                    'party': (reconcile_party.id
+                                        if reconcile_party else None),
+                                    'debit': debit,
+                                    'credit': credit,
+                                    }, {
+                                    'account': writeoff_account.id,
+                                    'party': (reconcile_party.id
+                                        if (writeoff_account.party_required
+                                            and reconcile_party)
+                                        else None),
+                                    'debit': credit,
+                                    'credit': debit,
+                                    }]),
+                        ],
+                    })
+        moves = Move.create(move_vlist) if move_vlist else []
+        for (lines, reconcile_account, debit, credit), move in zip(
+                to_writeoff, moves):
+            lines.append(next(l for l in move.lines
+                    if l.account == reconcile_account
+                    and (l.debit, l.credit) == (debit, credit)))
         return Reconciliation.create([{
                     'lines': [('add', [x.id for x in lines])],
                     'date': max(l.date for l in lines),
-                    }])[0]
+                    } for lines in groups])
+
+
+class LineOpenItem(ModelSQL):
+    '''
+    Account Move Line Open Item
+
+    It stores the move lines with a party on receivable and payable accounts
+    which are not reconciled.
+    '''
+    __name__ = 'account.move.line.open_item'
+    line = fields.Many2One('account.move.line', 'Line', required=True,
+        ondelete='CASCADE', select=True)
+    party = fields.Many2One('party.party', 'Party', required=True,
+        ondelete='CASCADE', select=True)
+    account = fields.Many2One('account.account', 'Account', required=True,
+        ondelete='CASCADE')
+    company = fields.Many2One('company.company', 'Company', required=True,
+        ondelete='CASCADE')
+    maturity_date = fields.Date('Maturity Date')
+    date = fields.Date('Date', required=True)
+    amount = fields.Numeric('Amount', required=True)
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        TableHandler = backend.get('TableHandler')
+        exist = TableHandler.table_exist(cls._table)
+
+        super(LineOpenItem, cls).__register__(module_name)
+
+        table = TableHandler(cls, module_name)
+        table.index_action(['party', 'account'], 'add')
+
+        if not exist and TableHandler.table_exist(Line._table):
+            cls._refresh(lambda line: Literal(True))
+
+    @classmethod
+    def refresh(cls, moves):
+        'Compute again the open items of the lines of the moves'
+        for sub_ids in grouped_slice([m.id for m in moves]):
+            sub_ids = list(sub_ids)
+            cls._refresh(lambda line: reduce_ids(line.move, sub_ids))
+
+    @classmethod
+    def _refresh(cls, where):
+        '''
+        Replace the open items of the lines matching where.
+        where is a function which returns the SQL clause for a line table.
+        '''
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        Account = pool.get('account.account')
+        PartyBalance = pool.get('party.party.balance')
+        table = cls.__table__()
+        line = Line.__table__()
+        move = Move.__table__()
+        account = Account.__table__()
+        cursor = Transaction().connection.cursor()
+
+        party_ids = set()
+        item_where = table.line.in_(line.select(line.id, where=where(line)))
+        cursor.execute(*table.select(table.party,
+                where=item_where, group_by=table.party))
+        party_ids.update(p for p, in cursor.fetchall())
+
+        cursor.execute(*table.delete(where=item_where))
+        cursor.execute(*table.insert([
+                    table.line, table.party, table.account, table.company,
+                    table.maturity_date, table.date, table.amount,
+                    ],
+                line.join(move, condition=line.move == move.id
+                    ).join(account, condition=line.account == account.id
+                    ).select(line.id, line.party, line.account,
+                    account.company, line.maturity_date, move.date,
+                    Coalesce(line.debit, 0) - Coalesce(line.credit, 0),
+                    where=where(line)
+                    & (line.party != Null)
+                    & (line.reconciliation == Null)
+                    & account.kind.in_(['receivable', 'payable']))))
+
+        cursor.execute(*table.select(table.party,
+                where=item_where, group_by=table.party))
+        party_ids.update(p for p, in cursor.fetchall())
+        PartyBalance.refresh(party_ids)
+
+
+class LineReconcilePair(ModelSQL):
+    '''
+    Account Move Line Reconcile Pair
+
+    It stores by account and party of the reconcilable accounts the number of
+    debit and credit move lines which are not reconciled and their balance.
+    The rows are updated with the amounts of the modified moves when they are
+    validated.
+    '''
+    __name__ = 'account.move.line.reconcile_pair'
+    account = fields.Many2One('account.account', "Account", required=True,
+        ondelete='CASCADE', select=True)
+    party = fields.Many2One('party.party', "Party", ondelete='CASCADE')
+    debit_count = fields.Integer("Debit Count", required=True)
+    credit_count = fields.Integer("Credit Count", required=True)
+    balance = fields.Numeric("Balance", required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(LineReconcilePair, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('account_party_unique', Unique(t, t.account, t.party),
+                'The pair must be unique per account and party.'),
+            ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        TableHandler = backend.get('TableHandler')
+        exist = TableHandler.table_exist(cls._table)
+
+        super(LineReconcilePair, cls).__register__(module_name)
+
+        if not exist and TableHandler.table_exist(Line._table):
+            cls._refresh()
+
+    @classmethod
+    def get_amounts(cls, moves):
+        '''
+        Return the debit count, credit count and balance of the lines not
+        reconciled of the moves by (account, party) of reconcilable accounts
+        '''
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Account = pool.get('account.account')
+        line = Line.__table__()
+        account = Account.__table__()
+        cursor = Transaction().connection.cursor()
+
+        balance = line.debit - line.credit
+        amounts = {}
+        for sub_ids in grouped_slice({m.id for m in moves}):
+            cursor.execute(*line.join(account,
+                    condition=line.account == account.id
+                    ).select(line.account, line.party,
+                    Sum(Case((balance > 0, 1), else_=0)),
+                    Sum(Case((balance < 0, 1), else_=0)),
+                    Sum(balance),
+                    where=(line.reconciliation == Null) & account.reconcile
+                    & reduce_ids(line.move, sub_ids),
+                    group_by=[line.account, line.party]))
+            for row in cursor.fetchall():
+                key = row[:2]
+                # SQLite uses float for SUM
+                values = (row[2], row[3], Decimal(str(row[4])))
+                if key in amounts:
+                    values = tuple(a + b for a, b in zip(amounts[key], values))
+                amounts[key] = values
+        return amounts
+
+    @classmethod
+    def update_amounts(cls, old_amounts, new_amounts):
+        '''
+        Add to the pairs the difference between the new and old amounts
+        returned by get_amounts
+        '''
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        zero = (0, 0, Decimal(0))
+
+        deltas = {}
+        for key in set(old_amounts) | set(new_amounts):
+            delta = tuple(n - o for n, o in zip(
+                    new_amounts.get(key, zero), old_amounts.get(key, zero)))
+            if any(delta):
+                deltas[key] = delta
+        if not deltas:
+            return
+
+        # Prevent concurrent insertion of the same key
+        transaction.database.lock(transaction.connection, cls._table)
+        account_ids = set()
+        for sub_keys in grouped_slice(list(deltas)):
+            sub_keys = list(sub_keys)
+            key2id = {}
+            cursor.execute(*table.select(table.id, table.account, table.party,
+                    where=reduce_ids(
+                        table.account, {k[0] for k in sub_keys})))
+            for row in cursor.fetchall():
+                key2id[row[1:]] = row[0]
+
+            to_update, to_insert = [], []
+            for key in sub_keys:
+                if key in key2id:
+                    to_update.append((key2id[key],) + deltas[key])
+                else:
+                    to_insert.append(list(key) + list(deltas[key]))
+                account_ids.add(key[0])
+
+            if to_update:
+                # Don't use UPDATE FROM because SQLite nor MySQL support it.
+                values = Values(to_update)
+
+                def get_delta(column):
+                    return values.select(column,
+                        where=values.column1 == table.id)
+                cursor.execute(*table.update([
+                            table.debit_count, table.credit_count,
+                            table.balance,
+                            ], [
+                            table.debit_count + get_delta(values.column2),
+                            table.credit_count + get_delta(values.column3),
+                            table.balance + get_delta(values.column4),
+                            ],
+                        where=reduce_ids(table.id, [r[0] for r in to_update])))
+            if to_insert:
+                cursor.execute(*table.insert([
+                            table.account, table.party,
+                            table.debit_count, table.credit_count,
+                            table.balance,
+                            ], to_insert))
+
+        # The balance is zero when there is no line
+        for sub_ids in grouped_slice(account_ids):
+            cursor.execute(*table.delete(
+                    where=reduce_ids(table.account, sub_ids)
+                    & (table.debit_count == 0) & (table.credit_count == 0)))
+
+    @classmethod
+    def _refresh(cls, account_ids=None, party_ids=None):
+        '''
+        Replace the rows of the accounts and parties by the count of the lines
+        not reconciled. If account_ids and party_ids are None, all the rows
+        are replaced.
+        '''
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        Account = pool.get('account.account')
+        table = cls.__table__()
+        line = Line.__table__()
+        account = Account.__table__()
+        cursor = Transaction().connection.cursor()
+
+        table_where = Literal(True)
+        line_where = (line.reconciliation == Null) & account.reconcile
+        if account_ids is not None:
+            table_where &= reduce_ids(table.account, account_ids)
+            line_where &= reduce_ids(line.account, account_ids)
+        if party_ids is not None:
+            table_where &= reduce_ids(table.party, party_ids)
+            line_where &= reduce_ids(line.party, party_ids)
+
+        balance = line.debit - line.credit
+        cursor.execute(*table.delete(where=table_where))
+        cursor.execute(*table.insert([
+                    table.account, table.party,
+                    table.debit_count, table.credit_count, table.balance,
+                    ],
+                line.join(account, condition=line.account == account.id
+                    ).select(line.account, line.party,
+                    Sum(Case((balance > 0, 1), else_=0)),
+                    Sum(Case((balance < 0, 1), else_=0)),
+                    Sum(balance),
+                    where=line_where,
+                    group_by=[line.account, line.party])))
 
 
 class OpenJournalAsk(ModelView):
@@ -1361,7 +2023,7 @@ class OpenAccount(Wizard):
         if Transaction().context.get('posted'):
             action['pyson_domain'].append(('move.state', '=', 'posted'))
         if Transaction().context.get('date'):
-            action['pyson_domain'].append(('move.date', '<=',
+            action['pyson_domain'].append(('date', '<=',
                     Transaction().context['date']))
         action['pyson_domain'] = PYSONEncoder().encode(action['pyson_domain'])
         action['pyson_context'] = PYSONEncoder().encode({
@@ -1473,32 +2135,35 @@ class Reconcile(Wizard):
         'Return a list of account id to reconcile'
         pool = Pool()
         Rule = pool.get('ir.rule')
+        Move = pool.get('account.move')
         Line = pool.get('account.move.line')
-        line = Line.__table__()
+        ReconcilePair = pool.get('account.move.line.reconcile_pair')
+        pair = ReconcilePair.__table__()
         Account = pool.get('account.account')
         account = Account.__table__()
         cursor = Transaction().connection.cursor()
         account_rule = Rule.query_get(Account.__name__)
 
         context = Transaction().context
-        if context['active_model'] == Line.__name__:
+        if context.get('active_model') == Line.__name__:
             lines = [l for l in Line.browse(context['active_ids'])
                 if not l.reconciliation]
             return list({l.account for l in lines if l.account.reconcile})
 
-        balance = line.debit - line.credit
-        cursor.execute(*line.join(account,
-                condition=line.account == account.id).select(
+        Move.flush_validate_move()
+        cursor.execute(*pair.join(account,
+                condition=pair.account == account.id).select(
                 account.id,
-                where=((line.reconciliation == Null) & account.reconcile
-                    & account.id.in_(account_rule)),
+                where=account.reconcile & account.id.in_(account_rule),
                 group_by=[account.id, account.kind],
                 having=((
-                        Sum(Case((balance > 0, 1), else_=0)) > 0)
-                    & (Sum(Case((balance < 0, 1), else_=0)) > 0)
-                    | (Case((account.kind == 'receivable', Sum(balance) < 0),
+                        Sum(pair.debit_count) > 0)
+                    & (Sum(pair.credit_count) > 0)
+                    | (Case((account.kind == 'receivable',
+                                Sum(pair.balance) < 0),
                             else_=False))
-                    | (Case((account.kind == 'payable', Sum(balance) > 0),
+                    | (Case((account.kind == 'payable',
+                                Sum(pair.balance) > 0),
                             else_=False))
                     )))
         return [a for a, in cursor.fetchall()]
@@ -1506,27 +2171,30 @@ class Reconcile(Wizard):
     def get_parties(self, account):
         'Return a list party to reconcile for the account'
         pool = Pool()
+        Move = pool.get('account.move')
         Line = pool.get('account.move.line')
-        line = Line.__table__()
+        ReconcilePair = pool.get('account.move.line.reconcile_pair')
+        pair = ReconcilePair.__table__()
         cursor = Transaction().connection.cursor()
 
         context = Transaction().context
-        if context['active_model'] == Line.__name__:
+        if context.get('active_model') == Line.__name__:
             lines = [l for l in Line.browse(context['active_ids'])
                 if not l.reconciliation]
             return list({l.party for l in lines if l.account == account})
 
-        balance = line.debit - line.credit
-        cursor.execute(*line.select(line.party,
-                where=(line.reconciliation == Null)
-                & (line.account == account.id),
-                group_by=line.party,
+        Move.flush_validate_move()
+        cursor.execute(*pair.select(pair.party,
+                where=pair.account == account.id,
+                group_by=pair.party,
                 having=((
-                        Sum(Case((balance > 0, 1), else_=0)) > 0)
-                    & (Sum(Case((balance < 0, 1), else_=0)) > 0)
-                    | (Case((account.kind == 'receivable', Sum(balance) < 0),
+                        Sum(pair.debit_count) > 0)
+                    & (Sum(pair.credit_count) > 0)
+                    | (Case((account.kind == 'receivable',
+                                Sum(pair.balance) < 0),
                             else_=False))
-                    | (Case((account.kind == 'payable', Sum(balance) > 0),
+                    | (Case((account.kind == 'payable',
+                                Sum(pair.balance) > 0),
                             else_=False))
                     )))
         return [p for p, in cursor.fetchall()]
@@ -1583,19 +2251,22 @@ class Reconcile(Wizard):
         'Return all lines to reconcile for the current state'
         pool = Pool()
         Line = pool.get('account.move.line')
-        return Line.search([
-                ('account', '=', self.show.account.id),
-                ('party', '=',
-                    self.show.party.id if self.show.party else None),
-                ('reconciliation', '=', None),
-                ])
+        domain = [
+            ('account', '=', self.show.account.id),
+            ('party', '=',
+                self.show.party.id if self.show.party else None),
+            ('reconciliation', '=', None),
+            ]
+        if Transaction().context.get('posted'):
+            domain.append(('move.state', '=', 'posted'))
+        return Line.search(domain)
 
     def _default_lines(self):
         'Return the larger list of lines which can be reconciled'
         pool = Pool()
         Line = pool.get('account.move.line')
         context = Transaction().context
-        if context['active_model'] == Line.__name__:
+        if context.get('active_model') == Line.__name__:
             requested = {l for l in Line.browse(context['active_ids'])
                 if l.account == self.show.account
                 and l.party == self.show.party}
@@ -1603,28 +2274,78 @@ class Reconcile(Wizard):
             requested = None
 
         currency = self.show.account.company.currency
-        chunk = config.getint('account', 'reconciliation_chunk', default=10)
-        # Combination is exponential so it must be limited to small number
-        default = []
-        for lines in grouped_slice(self._all_lines(), chunk):
-            lines = list(lines)
-            best = None
-            for n in xrange(len(lines), 1, -1):
-                for comb_lines in combinations(lines, n):
-                    if requested and not requested.intersection(comb_lines):
-                        continue
-                    amount = sum((l.debit - l.credit) for l in comb_lines)
-                    if currency.is_zero(amount):
-                        best = [l.id for l in comb_lines]
-                        break
-                if best:
-                    break
-            if best:
-                default.extend(best)
+        timeout = config.getfloat(
+            'account', 'reconciliation_timeout', default=5)
+        items = [(l, int(currency.round(l.debit - l.credit)
+                    / currency.rounding))
+            for l in self._all_lines()]
+        matcher = self._matcher(items, required=requested, timeout=timeout)
+        default = [l.id for l in matcher.match()]
         if not default and requested:
             default = map(int, requested)
         return default
 
+    def _matcher(self, items, required=None, timeout=None):
+        'Return the matcher of the zero-sum lines among items'
+        return ZeroSumMatcher(items, required=required, timeout=timeout)
+
+    @classmethod
+    def get_batch_pairs(cls):
+        'Return the list of (account id, party id) to reconcile in batch'
+        pool = Pool()
+        Account = pool.get('account.account')
+        session_id, _, _ = cls.create()
+        try:
+            wizard = cls(session_id)
+            with Transaction().set_context(active_model=None):
+                accounts = Account.browse(wizard.get_accounts())
+                return [(a.id, p) for a in accounts
+                    for p in wizard.get_parties(a)]
+        finally:
+            cls.delete(session_id)
+
+    @classmethod
+    def reconcile_batch(cls, pairs):
+        """Reconcile the proposal of each (account id, party id) pairs
+        using only the posted lines
+        Return the number of matched and skipped pairs"""
+        pool = Pool()
+        Account = pool.get('account.account')
+        Line = pool.get('account.move.line')
+        session_id, _, _ = cls.create()
+        try:
+            wizard = cls(session_id)
+            groups = []
+            with Transaction().set_context(active_model=None, posted=True):
+                for account_id, party_id in pairs:
+                    wizard.show.account = Account(account_id)
+                    wizard.show.party = party_id
+                    lines = wizard._default_lines()
+                    if lines:
+                        groups.append(Line.browse(lines))
+        finally:
+            cls.delete(session_id)
+        if groups and not cls._reconcile_groups(groups):
+            # Reconcile each group alone to skip only the failing ones
+            groups = [g for g in groups if cls._reconcile_groups([g])]
+        return len(groups), len(pairs) - len(groups)
+
+    @classmethod
+    def _reconcile_groups(cls, groups):
+        """Reconcile the groups of lines inside a savepoint
+        Return False if they could not be reconciled"""
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        cursor = Transaction().connection.cursor()
+        cursor.execute('SAVEPOINT reconcile_batch')
+        try:
+            Line.reconcile_many(groups)
+        except UserError:
+            cursor.execute('ROLLBACK TO SAVEPOINT reconcile_batch')
+            return False
+        cursor.execute('RELEASE SAVEPOINT reconcile_batch')
+        return True
+
     def transition_reconcile(self):
         pool = Pool()
         Line = pool.get('account.move.line')
@@ -1710,6 +2431,7 @@ class CancelMoves(Wizard):
         Line = pool.get('account.move.line')
 
         moves = Move.browse(Transaction().context['active_ids'])
+        groups = []
         for move in moves:
             default = self.default_cancel(move)
             cancel_move = move.cancel(default=default)
@@ -1717,8 +2439,8 @@ class CancelMoves(Wizard):
             for line in move.lines + cancel_move.lines:
                 if line.account.reconcile:
                     to_reconcile[line.account].append(line)
-            for lines in to_reconcile.itervalues():
-                Line.reconcile(lines)
+            groups.extend(to_reconcile.itervalues())
+        Line.reconcile_many(groups)
         return 'end'
 
 
@@ -4,10 +4,10 @@ from decimal import Decimal
 
 from sql import Literal, Null, Cast
 from sql.aggregate import Sum
-from sql.conditionals import Coalesce
+from sql.conditionals import Case, Coalesce
 
 from trytond import backend
-from trytond.model import ModelSQL, fields
+from trytond.model import ModelSQL, Unique, fields
 from trytond.pyson import Eval
 from trytond.transaction import Transaction
 from trytond.pool import Pool, PoolMeta
@@ -16,7 +16,7 @@ from trytond.tools.multivalue import migrate_property
 from trytond.modules.company.model import (
     CompanyMultiValueMixin, CompanyValueMixin)
 
-__all__ = ['Party', 'PartyAccount', 'PartyReplace']
+__all__ = ['Party', 'PartyAccount', 'PartyBalance', 'PartyReplace']
 account_names = [
     'account_payable', 'account_receivable',
     'customer_tax_rule', 'supplier_tax_rule']
@@ -117,13 +117,16 @@ class Party(CompanyMultiValueMixin):
         '''
         result = {}
         pool = Pool()
-        MoveLine = pool.get('account.move.line')
+        Move = pool.get('account.move')
+        OpenItem = pool.get('account.move.line.open_item')
         Account = pool.get('account.account')
         User = pool.get('res.user')
         Date = pool.get('ir.date')
         cursor = Transaction().connection.cursor()
 
-        line = MoveLine.__table__()
+        Move.flush_validate_move()
+
+        line = OpenItem.__table__()
         account = Account.__table__()
 
         for name in names:
@@ -138,28 +141,32 @@ class Party(CompanyMultiValueMixin):
         company_id = user.company.id
         to_round = False
 
-        amount = Sum(Coalesce(line.debit, 0) - Coalesce(line.credit, 0))
+        columns = []
+        codes = set()
         for name in names:
             code = name
-            today_where = Literal(True)
+            where = Literal(True)
             if name in ('receivable_today', 'payable_today'):
                 code = name[:-6]
-                today_where = ((line.maturity_date <= Date.today())
+                where = ((line.maturity_date <= Date.today())
                     | (line.maturity_date == Null))
-            for sub_parties in grouped_slice(parties):
-                sub_ids = [p.id for p in sub_parties]
-                party_where = reduce_ids(line.party, sub_ids)
-                cursor.execute(*line.join(account,
-                        condition=account.id == line.account
-                        ).select(line.party, amount,
-                        where=(account.active
-                            & (account.kind == code)
-                            & (line.reconciliation == Null)
-                            & (account.company == company_id)
-                            & party_where
-                            & today_where),
-                        group_by=line.party))
-                for party, value in cursor.fetchall():
+            codes.add(code)
+            columns.append(Sum(Case(((account.kind == code) & where,
+                            line.amount), else_=0)))
+        for sub_parties in grouped_slice(parties):
+            sub_ids = [p.id for p in sub_parties]
+            party_where = reduce_ids(line.party, sub_ids)
+            cursor.execute(*line.join(account,
+                    condition=account.id == line.account
+                    ).select(line.party, *columns,
+                    where=(account.active
+                        & account.kind.in_(list(codes))
+                        & (account.company == company_id)
+                        & party_where),
+                    group_by=line.party))
+            for row in cursor.fetchall():
+                party = row[0]
+                for name, value in zip(names, row[1:]):
                     # SQLite uses float for SUM
                     if not isinstance(value, Decimal):
                         value = Decimal(str(value))
@@ -176,12 +183,16 @@ class Party(CompanyMultiValueMixin):
     @classmethod
     def search_receivable_payable(cls, name, clause):
         pool = Pool()
+        Move = pool.get('account.move')
         MoveLine = pool.get('account.move.line')
+        OpenItem = pool.get('account.move.line.open_item')
+        PartyBalance = pool.get('party.party.balance')
         Account = pool.get('account.account')
         User = pool.get('res.user')
         Date = pool.get('ir.date')
 
-        line = MoveLine.__table__()
+        Move.flush_validate_move()
+        line = OpenItem.__table__()
         account = Account.__table__()
 
         if name not in ('receivable', 'payable',
@@ -194,36 +205,62 @@ class Party(CompanyMultiValueMixin):
             return []
         company_id = user.company.id
 
-        code = name
-        today_query = Literal(True)
-        if name in ('receivable_today', 'payable_today'):
-            code = name[:-6]
-            today_query = ((line.maturity_date <= Date.today())
-                | (line.maturity_date == Null))
-
         Operator = fields.SQL_OPERATORS[operator]
 
         # Need to cast numeric for sqlite
         type_ = MoveLine.debit.sql_type().base
-        amount = Cast(
-            Sum(Coalesce(line.debit, 0) - Coalesce(line.credit, 0)),
-            type_)
         if operator in {'in', 'not in'}:
             value = [Cast(Literal(Decimal(v or 0)), type_) for v in value]
         else:
             value = Cast(Literal(Decimal(value or 0)), type_)
+
+        if name in ('receivable', 'payable'):
+            balance = PartyBalance.__table__()
+            query = balance.select(balance.party,
+                where=(balance.company == company_id)
+                & (balance.kind == name)
+                & Operator(balance.balance, value))
+            return [('id', 'in', query)]
+
+        code = name[:-6]
+        today_query = ((line.maturity_date <= Date.today())
+            | (line.maturity_date == Null))
+        amount = Cast(Sum(line.amount), type_)
         query = line.join(account, condition=account.id == line.account
                 ).select(line.party,
                     where=account.active
                     & (account.kind == code)
-                    & (line.party != Null)
-                    & (line.reconciliation == Null)
                     & (account.company == company_id)
                     & today_query,
                     group_by=line.party,
                     having=Operator(amount, value))
         return [('id', 'in', query)]
 
+    def _order_balance(kind):
+        def order_balance(tables):
+            pool = Pool()
+            Move = pool.get('account.move')
+            PartyBalance = pool.get('party.party.balance')
+            User = pool.get('res.user')
+            Move.flush_validate_move()
+            table, _ = tables[None]
+            balance_tables = tables.get('balance_%s' % kind)
+            if balance_tables is None:
+                user = User(Transaction().user)
+                company_id = user.company.id if user.company else -1
+                balance = PartyBalance.__table__()
+                balance_tables = {
+                    None: (balance, (balance.party == table.id)
+                        & (balance.company == company_id)
+                        & (balance.kind == kind)),
+                    }
+                tables['balance_%s' % kind] = balance_tables
+            balance, _ = balance_tables[None]
+            return [Coalesce(balance.balance, 0)]
+        return staticmethod(order_balance)
+    order_receivable = _order_balance('receivable')
+    order_payable = _order_balance('payable')
+
     @property
     def account_payable_used(self):
         pool = Pool()
@@ -309,6 +346,84 @@ class PartyAccount(ModelSQL, CompanyValueMixin):
             parent='party', fields=fields)
 
 
+class PartyBalance(ModelSQL):
+    "Party Balance"
+    __name__ = 'party.party.balance'
+    company = fields.Many2One('company.company', "Company", required=True,
+        ondelete='CASCADE')
+    party = fields.Many2One('party.party', "Party", required=True,
+        ondelete='CASCADE', select=True)
+    kind = fields.Selection([
+            ('receivable', "Receivable"),
+            ('payable', "Payable"),
+            ], "Kind", required=True)
+    balance = fields.Numeric("Balance", required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(PartyBalance, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('party_kind_unique', Unique(t, t.company, t.party, t.kind),
+                'The balance must be unique per company, party and kind.'),
+            ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        OpenItem = pool.get('account.move.line.open_item')
+        TableHandler = backend.get('TableHandler')
+        exist = TableHandler.table_exist(cls._table)
+
+        super(PartyBalance, cls).__register__(module_name)
+
+        table = TableHandler(cls, module_name)
+        table.index_action(['company', 'kind', 'balance'], 'add')
+
+        if not exist and TableHandler.table_exist(OpenItem._table):
+            cls.refresh(None)
+
+    @classmethod
+    def refresh(cls, party_ids):
+        '''
+        Compute again the balances of the parties from the open items.
+        If party_ids is None, all the balances are computed.
+        '''
+        if party_ids is None:
+            cls._refresh(None)
+        else:
+            for sub_ids in grouped_slice(party_ids):
+                cls._refresh(list(sub_ids))
+
+    @classmethod
+    def _refresh(cls, party_ids):
+        pool = Pool()
+        OpenItem = pool.get('account.move.line.open_item')
+        Account = pool.get('account.account')
+        table = cls.__table__()
+        open_item = OpenItem.__table__()
+        account = Account.__table__()
+        cursor = Transaction().connection.cursor()
+
+        table_where = Literal(True)
+        open_item_where = account.active
+        if party_ids is not None:
+            table_where = reduce_ids(table.party, party_ids)
+            open_item_where &= reduce_ids(open_item.party, party_ids)
+
+        cursor.execute(*table.delete(where=table_where))
+        cursor.execute(*table.insert([
+                    table.company, table.party, table.kind, table.balance,
+                    ],
+                open_item.join(account,
+                    condition=open_item.account == account.id
+                    ).select(open_item.company, open_item.party,
+                    account.kind, Sum(open_item.amount),
+                    where=open_item_where,
+                    group_by=[open_item.company, open_item.party,
+                        account.kind])))
+
+
 class PartyReplace:
     __metaclass__ = PoolMeta
     __name__ = 'party.replace'
@@ -317,4 +432,19 @@ class PartyReplace:
     def fields_to_replace(cls):
         return super(PartyReplace, cls).fields_to_replace() + [
             ('account.move.line', 'party'),
+            ('account.move.line.open_item', 'party'),
             ]
+
+    def transition_replace(self):
+        pool = Pool()
+        PartyBalance = pool.get('party.party.balance')
+        PeriodBalance = pool.get('account.account.period_balance')
+        ReconcilePair = pool.get('account.move.line.reconcile_pair')
+        state = super(PartyReplace, self).transition_replace()
+        party_ids = [self.ask.source.id, self.ask.destination.id]
+        PartyBalance.refresh(party_ids)
+        # The balances and pairs are unique per party so they can not be
+        # replaced
+        PeriodBalance._refresh(party_ids)
+        ReconcilePair._refresh(party_ids=party_ids)
+        return state
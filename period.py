@@ -1,6 +1,7 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 from trytond.model import ModelView, ModelSQL, Workflow, fields
+from trytond.cache import Cache
 from trytond.pyson import Eval
 from trytond.transaction import Transaction
 from trytond.pool import Pool
@@ -49,6 +50,7 @@ class Period(Workflow, ModelSQL, ModelView):
     company = fields.Function(fields.Many2One('company.company', 'Company',),
         'on_change_with_company', searcher='search_company')
     icon = fields.Function(fields.Char("Icon"), 'get_icon')
+    _find_cache = Cache('account.period.find', context=False)
 
     @classmethod
     def __register__(cls, module_name):
@@ -194,22 +196,28 @@ class Period(Workflow, ModelSQL, ModelView):
 
         if not date:
             date = Date.today()
-        clause = [
-            ('start_date', '<=', date),
-            ('end_date', '>=', date),
-            ('fiscalyear.company', '=', company_id),
-            ('type', '=', 'standard'),
-            ]
-        if test_state:
-            clause.append(('state', '=', 'open'))
-        periods = cls.search(clause, order=[('start_date', 'DESC')], limit=1)
-        if not periods:
+        key = (company_id, date, test_state)
+        period_id = cls._find_cache.get(key, -1)
+        if period_id == -1:
+            clause = [
+                ('start_date', '<=', date),
+                ('end_date', '>=', date),
+                ('fiscalyear.company', '=', company_id),
+                ('type', '=', 'standard'),
+                ]
+            if test_state:
+                clause.append(('state', '=', 'open'))
+            periods = cls.search(
+                clause, order=[('start_date', 'DESC')], limit=1)
+            period_id = periods[0].id if periods else None
+            cls._find_cache.set(key, period_id)
+        if not period_id:
             if exception:
                 lang = Lang.get()
                 cls.raise_user_error('no_period_date', lang.strftime(date))
             else:
                 return None
-        return periods[0].id
+        return period_id
 
     @classmethod
     def _check(cls, periods):
@@ -261,7 +269,9 @@ class Period(Workflow, ModelSQL, ModelView):
                 if not vals.get('post_move_sequence'):
                     vals['post_move_sequence'] = (
                         fiscalyear.post_move_sequence.id)
-        return super(Period, cls).create(vlist)
+        periods = super(Period, cls).create(vlist)
+        cls._find_cache.clear()
+        return periods
 
     @classmethod
     def write(cls, *args):
@@ -298,11 +308,13 @@ class Period(Workflow, ModelSQL, ModelView):
                                 (period.rec_name,))
             args.extend((periods, values))
         super(Period, cls).write(*args)
+        cls._find_cache.clear()
 
     @classmethod
     def delete(cls, periods):
         cls._check(periods)
         super(Period, cls).delete(periods)
+        cls._find_cache.clear()
 
     @classmethod
     @ModelView.button
@@ -0,0 +1,53 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+from trytond import backend
+from trytond.transaction import Transaction
+from trytond.pool import PoolMeta
+
+__all__ = ['Sequence']
+
+sql_sequence = backend.get('Database').has_sequence()
+
+
+class Sequence:
+    __metaclass__ = PoolMeta
+    __name__ = 'ir.sequence'
+
+    @classmethod
+    def get_ids(cls, sequence_id, count):
+        '''
+        Return a list of count consecutive numbers of the sequence.
+        The incremental sequences are reserved with a single statement.
+        '''
+        if count <= 0:
+            return []
+        transaction = Transaction()
+        with transaction.set_context(user=False, _check_access=False):
+            with transaction.set_user(0):
+                sequence = cls(sequence_id)
+                date = transaction.context.get('date')
+                prefix = cls._process(sequence.prefix, date=date)
+                suffix = cls._process(sequence.suffix, date=date)
+                if sequence.type != 'incremental':
+                    numbers = [cls._get_sequence(sequence)
+                        for _ in xrange(count)]
+                else:
+                    numbers = ['%%0%sd' % sequence.padding % n
+                        for n in cls._reserve_numbers(sequence, count)]
+        return ['%s%s%s' % (prefix, number, suffix) for number in numbers]
+
+    @classmethod
+    def _reserve_numbers(cls, sequence, count):
+        'Reserve count numbers of the incremental sequence'
+        if sql_sequence and not cls._strict:
+            cursor = Transaction().connection.cursor()
+            cursor.execute('SELECT nextval(\'"%s"\') '
+                'FROM generate_series(1, %%s)' % sequence._sql_sequence_name,
+                (count,))
+            return sorted(n for n, in cursor.fetchall())
+        number_next = sequence.number_next_internal
+        increment = sequence.number_increment
+        cls.write([sequence], {
+                'number_next_internal': number_next + count * increment,
+                })
+        return [number_next + i * increment for i in xrange(count)]
@@ -1,9 +1,10 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import datetime
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 from decimal import Decimal
 from itertools import groupby
+from weakref import WeakKeyDictionary
 
 from sql.aggregate import Sum
 
@@ -11,6 +12,7 @@ from trytond.model import ModelView, ModelSQL, MatchMixin, fields, \
     sequence_ordered
 from trytond.wizard import Wizard, StateView, StateAction, Button
 from trytond import backend
+from trytond.tools import reduce_ids, grouped_slice
 from trytond.pyson import Eval, If, Bool, PYSONEncoder
 from trytond.transaction import Transaction
 from trytond.pool import Pool, PoolMeta
@@ -147,6 +149,7 @@ class TaxCode(ModelSQL, ModelView):
         'get_sum')
     template = fields.Many2One('account.tax.code.template', 'Template')
     description = fields.Text('Description')
+    _children_cache = WeakKeyDictionary()
 
     @classmethod
     def __setup__(cls):
@@ -172,6 +175,39 @@ class TaxCode(ModelSQL, ModelView):
             return self.company.currency.digits
         return 2
 
+    @classmethod
+    def get_children(cls):
+        """
+        Return a dictionary with the active children ids of each code id.
+        The dictionary is cached for the transaction.
+        """
+        transaction = Transaction()
+        active_test = transaction.context.get('active_test', True)
+        cache = cls._children_cache.setdefault(transaction, {})
+        if active_test not in cache:
+            cursor = transaction.connection.cursor()
+            table = cls.__table__()
+            where = None
+            if active_test:
+                where = table.active == True
+            cursor.execute(*table.select(table.id, table.parent,
+                    where=where))
+            children = cache[active_test] = defaultdict(list)
+            for code_id, parent_id in cursor.fetchall():
+                if parent_id:
+                    children[parent_id].append(code_id)
+        return cache[active_test]
+
+    @classmethod
+    def create(cls, vlist):
+        cls._children_cache.pop(Transaction(), None)
+        return super(TaxCode, cls).create(vlist)
+
+    @classmethod
+    def write(cls, *args):
+        cls._children_cache.pop(Transaction(), None)
+        super(TaxCode, cls).write(*args)
+
     @classmethod
     def get_sum(cls, codes, name):
         cursor = Transaction().connection.cursor()
@@ -184,33 +220,50 @@ class TaxCode(ModelSQL, ModelView):
         tax_line = TaxLine.__table__()
         move_line = MoveLine.__table__()
 
-        childs = cls.search([
-                ('parent', 'child_of', [c.id for c in codes]),
-                ])
-        all_codes = list(set(codes) | set(childs))
+        children = cls.get_children()
+        all_code_ids = set()
+        stack = [c.id for c in codes]
+        while stack:
+            code_id = stack.pop()
+            if code_id not in all_code_ids:
+                all_code_ids.add(code_id)
+                stack.extend(children[code_id])
+
         line_query, _ = MoveLine.query_get(move_line)
-        cursor.execute(*code.join(tax_line, condition=tax_line.code == code.id
-                ).join(move_line, condition=tax_line.move_line == move_line.id
-                ).select(code.id, Sum(tax_line.amount),
-                where=code.id.in_([c.id for c in all_codes])
-                & (code.active == True) & line_query,
-                group_by=code.id))
         code_sum = {}
-        for code_id, sum in cursor.fetchall():
-            # SQLite uses float for SUM
-            if not isinstance(sum, Decimal):
-                sum = Decimal(str(sum))
-            code_sum[code_id] = sum
-
+        for sub_ids in grouped_slice(all_code_ids):
+            cursor.execute(*code.join(tax_line,
+                    condition=tax_line.code == code.id
+                    ).join(move_line,
+                    condition=tax_line.move_line == move_line.id
+                    ).select(code.id, Sum(tax_line.amount),
+                    where=reduce_ids(code.id, sub_ids)
+                    & (code.active == True) & line_query,
+                    group_by=code.id))
+            for code_id, amount in cursor.fetchall():
+                # SQLite uses float for SUM
+                if not isinstance(amount, Decimal):
+                    amount = Decimal(str(amount))
+                code_sum[code_id] = amount
+
+        # Sum the rounded amount of each code with its descendants
+        totals = {}
         for code in codes:
-            res.setdefault(code.id, Decimal('0.0'))
-            childs = cls.search([
-                    ('parent', 'child_of', [code.id]),
-                    ])
-            for child in childs:
-                res[code.id] += code.company.currency.round(
-                    code_sum.get(child.id, Decimal('0.0')))
-            res[code.id] = code.company.currency.round(res[code.id])
+            currency = code.company.currency
+            stack = [(code.id, False)]
+            while stack:
+                code_id, visited = stack.pop()
+                if code_id in totals:
+                    continue
+                if visited:
+                    totals[code_id] = currency.round(
+                        code_sum.get(code_id, Decimal('0.0'))) + sum(
+                        (totals[c] for c in children[code_id]),
+                        Decimal('0.0'))
+                else:
+                    stack.append((code_id, True))
+                    stack.extend((c, False) for c in children[code_id])
+            res[code.id] = currency.round(totals[code.id])
         return res
 
     def get_rec_name(self, name):
@@ -244,6 +297,7 @@ class TaxCode(ModelSQL, ModelView):
         codes = cls.search([
                 ('parent', 'child_of', [c.id for c in codes]),
                 ])
+        cls._children_cache.pop(Transaction(), None)
         super(TaxCode, cls).delete(codes)
 
     @classmethod
@@ -12,9 +12,11 @@ from trytond.tests.test_tryton import doctest_teardown
 from trytond.tests.test_tryton import doctest_checker
 from trytond.transaction import Transaction
 from trytond.exceptions import UserError
+from trytond.config import config
 
 from trytond.modules.company.tests import create_company, set_company
 from trytond.modules.currency.tests import create_currency
+from trytond.modules.account.matching import ZeroSumMatcher
 
 
 def create_chart(company, tax=False):
@@ -202,6 +204,56 @@ class AccountTestCase(ModuleTestCase):
             FiscalYear.create_period([fiscalyear])
             self.assertEqual(len(fiscalyear.periods), 12)
 
+    @with_transaction()
+    def test_period_find(self):
+        "Test finding period and fiscal year"
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        Period = pool.get('account.period')
+        company = create_company()
+        with set_company(company):
+            self.assertIsNone(FiscalYear.find(company.id, exception=False))
+            self.assertIsNone(Period.find(company.id, exception=False))
+
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            self.assertEqual(FiscalYear.find(company.id), fiscalyear.id)
+            self.assertIsNone(Period.find(company.id, exception=False))
+
+            FiscalYear.create_period([fiscalyear])
+            period = Period.find(company.id)
+            self.assertIn(period, [p.id for p in fiscalyear.periods])
+
+            Period.close([Period(period)])
+            self.assertIsNone(Period.find(company.id, exception=False))
+            self.assertEqual(
+                Period.find(company.id, test_state=False), period)
+
+    @with_transaction()
+    def test_move_line_query_get(self):
+        "Test move line query_get with fiscal year changes"
+        pool = Pool()
+        Line = pool.get('account.move.line')
+        line = Line.__table__()
+        company = create_company()
+        with set_company(company):
+            _, fiscalyear_ids = Line.query_get(line)
+            self.assertEqual(fiscalyear_ids, [])
+
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            _, fiscalyear_ids = Line.query_get(line)
+            self.assertEqual(fiscalyear_ids, [fiscalyear.id])
+
+            date = fiscalyear.start_date - relativedelta(years=1)
+            with Transaction().set_context(date=date):
+                _, fiscalyear_ids = Line.query_get(line)
+                self.assertEqual(fiscalyear_ids, [])
+                previous = get_fiscalyear(company, today=date)
+                previous.save()
+                _, fiscalyear_ids = Line.query_get(line)
+                self.assertEqual(fiscalyear_ids, [previous.id])
+
     @with_transaction()
     def test_account_debit_credit(self):
         'Test account debit/credit'
@@ -211,6 +263,8 @@ class AccountTestCase(ModuleTestCase):
         Journal = pool.get('account.journal')
         Account = pool.get('account.account')
         Move = pool.get('account.move')
+        GeneralLedger = pool.get('account.general_ledger.account')
+        GeneralLedgerLine = pool.get('account.general_ledger.line')
 
         party = Party(name='Party')
         party.save()
@@ -308,6 +362,61 @@ class AccountTestCase(ModuleTestCase):
             self.assertEqual((revenue.debit, revenue.credit),
                 (Decimal(0), Decimal(100)))
             self.assertEqual(revenue.balance, Decimal(-100))
+            root, = Account.search([
+                    ('parent', '=', None),
+                    ])
+            self.assertEqual(root.balance, Decimal(0))
+
+            # Test general ledger
+            with Transaction().set_context(fiscalyear=fiscalyear.id):
+                gl_revenue = GeneralLedger(revenue.id)
+                self.assertEqual(
+                    (gl_revenue.start_balance, gl_revenue.credit,
+                        gl_revenue.end_balance),
+                    (Decimal(0), Decimal(100), Decimal(-100)))
+                self.assertEqual(
+                    set(GeneralLedger.search([('end_balance', '!=', 0)])),
+                    set(GeneralLedger.browse([revenue.id, receivable.id,
+                                expense.id, payable.id, cash_cur.id])))
+                self.assertEqual(
+                    GeneralLedger.search([('credit', '>', 90)]),
+                    [GeneralLedger(revenue.id)])
+
+                gl_lines = GeneralLedgerLine.search([
+                        ('account', '=', receivable.id),
+                        ], order=[('date', 'ASC'), ('id', 'ASC')])
+                self.assertEqual([l.balance for l in gl_lines],
+                    [Decimal(100), Decimal(20)])
+                self.assertEqual(
+                    GeneralLedgerLine.read([gl_lines[-1].id], ['balance']),
+                    [{'id': gl_lines[-1].id, 'balance': Decimal(20)}])
+
+            # Test general ledger opening line
+            with Transaction().set_context(fiscalyear=fiscalyear.id,
+                    from_date=period.start_date + datetime.timedelta(days=1)):
+                gl_line, = GeneralLedgerLine.search([
+                        ('account', '=', receivable.id),
+                        ])
+                self.assertGreater(gl_line.id, 0)
+                self.assertEqual(gl_line.id % 2, 1)
+                self.assertEqual(gl_line.move, None)
+                self.assertEqual((gl_line.debit, gl_line.credit),
+                    (Decimal(100), Decimal(80)))
+                self.assertEqual(gl_line.balance, Decimal(20))
+                self.assertEqual(GeneralLedgerLine.search([
+                            ('account', '=', receivable.id),
+                            ]), [gl_line])
+                values, = GeneralLedgerLine.read([gl_line.id],
+                    list(GeneralLedgerLine._fields.keys()))
+                self.assertEqual(values['account'], receivable.id)
+                self.assertEqual(values['date'],
+                    period.start_date + datetime.timedelta(days=1))
+                self.assertEqual(gl_line.date, values['date'])
+                self.assertEqual(values['company'], company.id)
+                self.assertEqual(values['balance'], Decimal(20))
+                for name in ['move', 'party', 'origin', 'description',
+                        'move_description', 'state']:
+                    self.assertEqual(values[name], None, msg=name)
 
             self.assertEqual((cash_cur.debit, cash_cur.credit),
                 (Decimal(80), Decimal(0)))
@@ -344,6 +453,34 @@ class AccountTestCase(ModuleTestCase):
                 self.assertEqual(
                     cash_cur.amount_second_currency, Decimal(50))
 
+            # Test opening is updated when previous year changes
+            move, = Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': revenue.id,
+                                        'credit': Decimal(10),
+                                        }, {
+                                        'account': receivable.id,
+                                        'debit': Decimal(10),
+                                        'party': party.id,
+                                        }]),
+                            ],
+                        }])
+            with Transaction().set_context(fiscalyear=next_fiscalyear.id,
+                    cumulate=True):
+                revenue = Account(revenue.id)
+                self.assertEqual((revenue.debit, revenue.credit),
+                    (Decimal(0), Decimal(110)))
+                self.assertEqual(revenue.balance, Decimal(-110))
+            Move.delete([move])
+            with Transaction().set_context(fiscalyear=next_fiscalyear.id,
+                    cumulate=True):
+                revenue = Account(revenue.id)
+                self.assertEqual(revenue.balance, Decimal(-100))
+
             close_fiscalyear(fiscalyear)
 
             # Check deferral
@@ -410,16 +547,993 @@ class AccountTestCase(ModuleTestCase):
                     cash_cur.amount_second_currency, Decimal(50))
 
     @with_transaction()
-    def test_move_post(self):
-        "Test posting move"
+    def test_account_period_balance(self):
+        'Test account period balance'
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+        PeriodBalance = pool.get('account.account.period_balance')
+
+        party = Party(name='Party')
+        party.save()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+            cash, = Account.search([
+                    ('kind', '=', 'other'),
+                    ('name', '=', 'Main Cash'),
+                    ])
+
+            move = Move()
+            move.period = period
+            move.journal = journal_revenue
+            move.date = period.start_date
+            move.lines = [
+                Line(account=revenue, credit=Decimal(100)),
+                Line(account=receivable, debit=Decimal(100), party=party),
+                ]
+            move.save()
+            Move.flush_validate_move()
+
+            balance, = PeriodBalance.search([
+                    ('account', '=', receivable.id),
+                    ])
+            self.assertEqual(balance.period, period)
+            self.assertEqual(balance.party, party)
+            self.assertEqual((balance.debit, balance.credit),
+                (Decimal(100), Decimal(0)))
+            self.assertFalse(balance.posted)
+
+            Move.post([move])
+            Move.flush_validate_move()
+            balance, = PeriodBalance.search([
+                    ('account', '=', receivable.id),
+                    ])
+            self.assertTrue(balance.posted)
+
+            # Aligned and not aligned periods give the same result
+            for context, debit in [
+                    ({'periods': [period.id]}, Decimal(100)),
+                    ({'from_date': period.start_date}, Decimal(100)),
+                    ({'from_date': period.start_date
+                            + datetime.timedelta(1)}, Decimal(0)),
+                    ({'to_date': period.end_date}, Decimal(100)),
+                    ({'posted': True}, Decimal(100)),
+                    ]:
+                with Transaction().set_context(context):
+                    receivable = Account(receivable.id)
+                    self.assertEqual((receivable.debit, receivable.credit),
+                        (debit, Decimal(0)))
+
+            move, = Move.copy([move])
+            line, = [l for l in move.lines if l.account == receivable]
+            revenue_line, = [l for l in move.lines if l.account == revenue]
+            Line.write([line], {'account': cash.id, 'party': None})
+            Move.flush_validate_move()
+            balance, = PeriodBalance.search([
+                    ('account', '=', cash.id),
+                    ])
+            self.assertEqual(balance.party, None)
+            self.assertEqual((balance.debit, balance.credit),
+                (Decimal(100), Decimal(0)))
+            self.assertFalse(balance.posted)
+
+            Line.write([line], {'debit': Decimal(40)},
+                [revenue_line], {'credit': Decimal(40)})
+            Move.flush_validate_move()
+            balance, = PeriodBalance.search([
+                    ('account', '=', cash.id),
+                    ])
+            self.assertEqual((balance.debit, balance.credit),
+                (Decimal(40), Decimal(0)))
+            balance, = PeriodBalance.search([
+                    ('account', '=', revenue.id),
+                    ('posted', '=', False),
+                    ])
+            self.assertEqual((balance.debit, balance.credit),
+                (Decimal(0), Decimal(40)))
+            self.assertEqual(PeriodBalance.search([
+                        ('account', '=', receivable.id),
+                        ], count=True), 1)
+
+            Move.delete([move])
+            Move.flush_validate_move()
+            self.assertEqual(PeriodBalance.search([
+                        ('account', '=', cash.id),
+                        ], count=True), 0)
+            receivable = Account(receivable.id)
+            self.assertEqual(receivable.balance, Decimal(100))
+
+    @with_transaction()
+    def test_account_type_amount(self):
+        'Test account type amount'
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Type = pool.get('account.account.type')
+        Move = pool.get('account.move')
+
+        party = Party(name='Party')
+        party.save()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            next_fiscalyear = get_fiscalyear(company,
+                today=fiscalyear.end_date + datetime.timedelta(1))
+            next_fiscalyear.save()
+            FiscalYear.create_period([next_fiscalyear])
+            next_period = next_fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+            cash, = Account.search([
+                    ('kind', '=', 'other'),
+                    ('name', '=', 'Main Cash'),
+                    ])
+
+            for period_, account, amount, party_ in [
+                    (period, receivable, Decimal(100), party),
+                    (next_period, cash, Decimal(30), None),
+                    ]:
+                Move.create([{
+                            'period': period_.id,
+                            'journal': journal_revenue.id,
+                            'date': period_.start_date,
+                            'lines': [
+                                ('create', [{
+                                            'account': revenue.id,
+                                            'credit': amount,
+                                            }, {
+                                            'account': account.id,
+                                            'debit': amount,
+                                            'party': (party_.id
+                                                if party_ else None),
+                                            }]),
+                                ],
+                            }])
+
+            current = receivable.type.parent
+            self.assertEqual(cash.type.parent, current)
+            asset = current.parent
+            self.assertTrue(asset.parent)
+
+            with Transaction().set_context(
+                    date=next_period.end_date, cumulate=True,
+                    comparison=True, date_cmp=fiscalyear.end_date):
+                for type_, amount, amount_cmp in [
+                        (receivable.type, Decimal(100), Decimal(100)),
+                        (cash.type, Decimal(30), Decimal(0)),
+                        (current, Decimal(130), Decimal(100)),
+                        (asset, Decimal(130), Decimal(100)),
+                        (revenue.type, Decimal(130), Decimal(100)),
+                        ]:
+                    type_ = Type(type_.id)
+                    self.assertEqual(
+                        (type_.amount, type_.amount_cmp),
+                        (amount, amount_cmp), msg=type_.name)
+
+            close_fiscalyear(fiscalyear)
+            with Transaction().set_context(
+                    date=next_period.end_date, cumulate=True):
+                for type_, amount in [
+                        (receivable.type, Decimal(100)),
+                        (asset, Decimal(130)),
+                        (revenue.type, Decimal(30)),
+                        ]:
+                    type_ = Type(type_.id)
+                    self.assertEqual(type_.amount, amount, msg=type_.name)
+
+    @with_transaction()
+    def test_general_ledger_account(self):
+        'Test general ledger account'
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        GeneralLedgerAccount = pool.get('account.general_ledger.account')
+        Move = pool.get('account.move')
+
+        party = Party(name='Party')
+        party.save()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            periods = fiscalyear.periods
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+
+            for period, date, amount in [
+                    (periods[0], periods[0].start_date, Decimal(100)),
+                    (periods[1], periods[1].start_date
+                        + datetime.timedelta(10), Decimal(50)),
+                    (periods[2], periods[2].start_date, Decimal(20)),
+                    ]:
+                Move.create([{
+                            'period': period.id,
+                            'journal': journal_revenue.id,
+                            'date': date,
+                            'lines': [
+                                ('create', [{
+                                            'account': revenue.id,
+                                            'credit': amount,
+                                            }, {
+                                            'account': receivable.id,
+                                            'debit': amount,
+                                            'party': party.id,
+                                            }]),
+                                ],
+                            }])
+
+            # Aligned on periods uses the period balances
+            # and not aligned uses the lines
+            for context in [{
+                        'start_period': periods[1].id,
+                        'end_period': periods[1].id,
+                        }, {
+                        'start_period': periods[1].id,
+                        'end_period': periods[1].id,
+                        'from_date': (
+                            periods[1].start_date + datetime.timedelta(5)),
+                        'to_date': (
+                            periods[1].end_date - datetime.timedelta(5)),
+                        }]:
+                context['fiscalyear'] = fiscalyear.id
+                with Transaction().set_context(context):
+                    for account, values in [
+                            (receivable, [
+                                    Decimal(100), Decimal(0), Decimal(100),
+                                    Decimal(50), Decimal(0),
+                                    Decimal(150), Decimal(0), Decimal(150),
+                                    ]),
+                            (revenue, [
+                                    Decimal(0), Decimal(100), Decimal(-100),
+                                    Decimal(0), Decimal(50),
+                                    Decimal(0), Decimal(150), Decimal(-150),
+                                    ]),
+                            ]:
+                        gl_account = GeneralLedgerAccount(account.id)
+                        self.assertEqual([
+                                gl_account.start_debit,
+                                gl_account.start_credit,
+                                gl_account.start_balance,
+                                gl_account.debit,
+                                gl_account.credit,
+                                gl_account.end_debit,
+                                gl_account.end_credit,
+                                gl_account.end_balance,
+                                ], values)
+
+    @with_transaction()
+    def test_move_post(self):
+        "Test posting move"
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+        Period = pool.get('account.period')
+
+        party = Party(name='Party')
+        party.save()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+
+            move = Move()
+            move.period = period
+            move.journal = journal_revenue
+            move.date = period.start_date
+            move.lines = [
+                Line(account=revenue, credit=Decimal(100)),
+                Line(account=receivable, debit=Decimal(100), party=party),
+                ]
+            move.save()
+            Move.post([move])
+            move_id = move.id
+
+            self.assertEqual(move.state, 'posted')
+
+            moves = []
+            for amount in [Decimal(50), Decimal(20)]:
+                other = Move()
+                other.period = period
+                other.journal = journal_revenue
+                other.date = period.start_date
+                other.lines = [
+                    Line(account=revenue, credit=amount),
+                    Line(account=receivable, debit=amount, party=party),
+                    Line(account=receivable, debit=Decimal(0),
+                        credit=Decimal(0), party=party),
+                    ]
+                other.save()
+                moves.append(other)
+            Move.post(moves)
+            moves = Move.browse(moves)
+            self.assertEqual({m.state for m in moves}, {'posted'})
+            self.assertEqual(len({m.post_number for m in moves}), 2)
+            self.assertTrue(all(m.post_number and m.post_date for m in moves))
+            for other in moves:
+                zero_line, = [l for l in other.lines
+                    if not l.debit and not l.credit]
+                self.assertTrue(zero_line.reconciliation)
+
+            # Can not post an empty move
+            with self.assertRaises(UserError):
+                move = Move()
+                move.period = period
+                move.journal = journal_revenue
+                move.date = period.start_date
+                move.save()
+                Move.post([move])
+            Move.delete([move])
+
+            # Can not modify posted move
+            with self.assertRaises(UserError):
+                move = Move(move_id)
+                move.date = period.end_date
+                move.save()
+
+            # Can not go back to draft
+            with self.assertRaises(UserError):
+                move = Move(move_id)
+                move.state = 'draft'
+                move.save()
+
+            Period.close([period])
+
+            # Can not create move with lines on closed period
+            with self.assertRaises(UserError):
+                move = Move()
+                move.period = period
+                move.journal = journal_revenue
+                move.date = period.start_date
+                move.lines = [
+                    Line(account=revenue, credit=Decimal(100)),
+                    Line(account=receivable, debit=Decimal(100), party=party),
+                    ]
+                move.save()
+
+    @with_transaction()
+    def test_sequence_get_ids(self):
+        "Test reserving sequence numbers"
+        pool = Pool()
+        Sequence = pool.get('ir.sequence')
+
+        sequence, = Sequence.create([{
+                    'name': 'Test',
+                    'code': 'account.move',
+                    'prefix': 'M',
+                    'padding': 3,
+                    'number_increment': 2,
+                    }])
+        self.assertEqual(Sequence.get_ids(sequence.id, 0), [])
+        self.assertEqual(
+            Sequence.get_ids(sequence.id, 3), ['M001', 'M003', 'M005'])
+        self.assertEqual(Sequence.get_id(sequence.id), 'M007')
+
+    @with_transaction()
+    def test_move_line_move_fields(self):
+        "Test move fields copied on move lines"
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period, next_period = fiscalyear.periods[:2]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            expense, = Account.search([
+                    ('kind', '=', 'expense'),
+                    ])
+
+            move, = Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': revenue.id,
+                                        'credit': Decimal(100),
+                                        }, {
+                                        'account': expense.id,
+                                        'debit': Decimal(100),
+                                        }]),
+                            ],
+                        }])
+            for line in move.lines:
+                self.assertEqual(line.period, period)
+                self.assertEqual(line.date, period.start_date)
+                self.assertEqual(line.fiscalyear, fiscalyear)
+                self.assertEqual(line.company, company)
+
+            Move.write([move], {
+                    'period': next_period.id,
+                    'date': next_period.start_date,
+                    })
+            self.assertEqual(set(Line.search([
+                        ('period', '=', next_period.id),
+                        ('date', '=', next_period.start_date),
+                        ])), set(move.lines))
+
+            line = move.lines[0]
+            Line.write([line], {
+                    'date': next_period.end_date,
+                    })
+            self.assertEqual(Move(move.id).date, next_period.end_date)
+            self.assertEqual(set(Line.search([
+                        ('date', '=', next_period.end_date),
+                        ('fiscalyear', '=', fiscalyear.id),
+                        ])), set(move.lines))
+
+    @with_transaction()
+    def test_reconciliation_check_lines(self):
+        "Test check lines of reconciliation"
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Reconciliation = pool.get('account.move.reconciliation')
+
+        party1, party2 = Party.create([
+                {'name': 'Party 1'},
+                {'name': 'Party 2'},
+                ])
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+
+            vlist = []
+            for party, amount in [
+                    (party1, Decimal(10)),
+                    (party1, Decimal(-10)),
+                    (party2, Decimal(-10)),
+                    (party1, Decimal(-8)),
+                    ]:
+                debit = amount if amount > 0 else Decimal(0)
+                credit = -amount if amount < 0 else Decimal(0)
+                vlist.append({
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': receivable.id,
+                                        'party': party.id,
+                                        'debit': debit,
+                                        'credit': credit,
+                                        }, {
+                                        'account': revenue.id,
+                                        'debit': credit,
+                                        'credit': debit,
+                                        }]),
+                            ],
+                        })
+            moves = Move.create(vlist)
+            line1, line2, line3, line4 = [l for m in moves for l in m.lines
+                if l.account == receivable]
+            revenue_line = [l for l in moves[0].lines
+                if l.account == revenue][0]
+
+            for lines in [
+                    [line1, line3],
+                    [line1, line4],
+                    [line1, revenue_line],
+                    ]:
+                with self.assertRaises(UserError):
+                    Reconciliation.create([{
+                                'lines': [('add', [l.id for l in lines])],
+                                'date': period.start_date,
+                                }])
+
+            reconciliation, = Reconciliation.create([{
+                        'lines': [('add', [line1.id, line2.id])],
+                        'date': period.start_date,
+                        }])
+            self.assertEqual(set(reconciliation.lines), {line1, line2})
+
+    @with_transaction()
+    def test_line_reconcile_many(self):
+        "Test reconciliation of many groups of lines"
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Sequence = pool.get('ir.sequence')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+
+        party = Party(name='Party')
+        party.save()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            expense, = Account.search([
+                    ('kind', '=', 'expense'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+            sequence, = Sequence.search([
+                    ('code', '=', 'account.journal'),
+                    ])
+            journal_writeoff = Journal(name='Write-Off', type='write-off',
+                sequence=sequence, credit_account=revenue,
+                debit_account=expense)
+            journal_writeoff.save()
+
+            vlist = []
+            for amount in [
+                    Decimal(10), Decimal(-7), Decimal(20), Decimal(-18)]:
+                debit = amount if amount > 0 else Decimal(0)
+                credit = -amount if amount < 0 else Decimal(0)
+                vlist.append({
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': receivable.id,
+                                        'party': party.id,
+                                        'debit': debit,
+                                        'credit': credit,
+                                        }, {
+                                        'account': revenue.id,
+                                        'debit': credit,
+                                        'credit': debit,
+                                        }]),
+                            ],
+                        })
+            moves = Move.create(vlist)
+            line1, line2, line3, line4 = [l for m in moves for l in m.lines
+                if l.account == receivable]
+
+            reconciliations = Line.reconcile_many(
+                [[line1, line2], [line3, line4]], journal=journal_writeoff)
+            self.assertEqual(len(reconciliations), 2)
+            for reconciliation, lines, amount in zip(reconciliations,
+                    [{line1, line2}, {line3, line4}],
+                    [Decimal(3), Decimal(2)]):
+                self.assertEqual(len(reconciliation.lines), 3)
+                writeoff, = [l for l in reconciliation.lines
+                    if l not in lines]
+                self.assertEqual(writeoff.credit, amount)
+                self.assertEqual(writeoff.account, receivable)
+                self.assertEqual(writeoff.move.journal, journal_writeoff)
+
+            with self.assertRaises(UserError):
+                Line.reconcile_many([[line1, line2]])
+
+    @with_transaction()
+    def test_reconcile_pair(self):
+        "Test reconcile pairs"
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+        Reconciliation = pool.get('account.move.reconciliation')
+        ReconcilePair = pool.get('account.move.line.reconcile_pair')
+
+        party1, party2 = Party.create([
+                {'name': 'Party 1'},
+                {'name': 'Party 2'},
+                ])
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+
+            vlist = []
+            for amount in [Decimal(10), Decimal(-10), Decimal(5)]:
+                debit = amount if amount > 0 else Decimal(0)
+                credit = -amount if amount < 0 else Decimal(0)
+                vlist.append({
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': receivable.id,
+                                        'party': party1.id,
+                                        'debit': debit,
+                                        'credit': credit,
+                                        }, {
+                                        'account': revenue.id,
+                                        'debit': credit,
+                                        'credit': debit,
+                                        }]),
+                            ],
+                        })
+            moves = Move.create(vlist)
+            line1, line2, line3 = [l for m in moves for l in m.lines
+                if l.account == receivable]
+
+            def pairs():
+                Move.flush_validate_move()
+                return {(p.account, p.party): (
+                        p.debit_count, p.credit_count, p.balance)
+                    for p in ReconcilePair.search([
+                            ('account', '=', receivable.id),
+                            ])}
+
+            self.assertEqual(pairs(), {
+                    (receivable, party1): (2, 1, Decimal(5)),
+                    })
+
+            Line.write([line3], {'party': party2.id})
+            self.assertEqual(pairs(), {
+                    (receivable, party1): (1, 1, Decimal(0)),
+                    (receivable, party2): (1, 0, Decimal(5)),
+                    })
+
+            reconciliation = Line.reconcile([line1, line2])
+            self.assertEqual(pairs(), {
+                    (receivable, party2): (1, 0, Decimal(5)),
+                    })
+
+            Reconciliation.delete([reconciliation])
+            self.assertEqual(pairs(), {
+                    (receivable, party1): (1, 1, Decimal(0)),
+                    (receivable, party2): (1, 0, Decimal(5)),
+                    })
+
+            Line.delete([line3])
+            self.assertEqual(pairs(), {
+                    (receivable, party1): (1, 1, Decimal(0)),
+                    })
+
+            # Only the reconcilable accounts have pairs
+            self.assertFalse(revenue.reconcile)
+            self.assertEqual(ReconcilePair.search([
+                        ('account', '=', revenue.id),
+                        ]), [])
+            Account.write([revenue], {'reconcile': True})
+            pair, = ReconcilePair.search([
+                    ('account', '=', revenue.id),
+                    ])
+            self.assertEqual((pair.debit_count, pair.credit_count),
+                (1, 2))
+            Account.write([revenue], {'reconcile': False})
+            self.assertEqual(ReconcilePair.search([
+                        ('account', '=', revenue.id),
+                        ]), [])
+
+    @with_transaction()
+    def test_reconcile_batch(self):
+        "Test batch reconciliation of accounts"
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+        Reconcile = pool.get('account.reconcile', type='wizard')
+
+        party1, party2, party3 = Party.create([
+                {'name': 'Party 1'},
+                {'name': 'Party 2'},
+                {'name': 'Party 3'},
+                ])
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+
+            def get_move(party, amount):
+                debit = amount if amount > 0 else Decimal(0)
+                credit = -amount if amount < 0 else Decimal(0)
+                return {
+                    'period': period.id,
+                    'journal': journal_revenue.id,
+                    'date': period.start_date,
+                    'lines': [
+                        ('create', [{
+                                    'account': receivable.id,
+                                    'party': party.id,
+                                    'debit': debit,
+                                    'credit': credit,
+                                    }, {
+                                    'account': revenue.id,
+                                    'debit': credit,
+                                    'credit': debit,
+                                    }]),
+                        ],
+                    }
+            moves = Move.create([get_move(party, amount)
+                    for party, amount in [
+                        (party1, Decimal(100)),
+                        (party1, Decimal(-60)),
+                        (party1, Decimal(-40)),
+                        (party1, Decimal(5)),
+                        (party2, Decimal(30)),
+                        (party2, Decimal(-20)),
+                        ]])
+            Move.post(moves)
+            # The lines of draft moves are not reconciled
+            Move.create([get_move(party3, Decimal(50)),
+                    get_move(party3, Decimal(-50))])
+
+            pairs = Reconcile.get_batch_pairs()
+            self.assertEqual(sorted(pairs), [
+                    (receivable.id, party1.id),
+                    (receivable.id, party2.id),
+                    (receivable.id, party3.id),
+                    ])
+            self.assertEqual(Reconcile.reconcile_batch(pairs), (1, 2))
+
+            reconciled = Line.search([
+                    ('account', '=', receivable.id),
+                    ('reconciliation', '!=', None),
+                    ])
+            self.assertEqual(
+                sorted(l.debit - l.credit for l in reconciled),
+                [Decimal(-60), Decimal(-40), Decimal(100)])
+
+    @with_transaction()
+    def test_move_validate_queue(self):
+        "Test queued validation of moves"
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+        line_table = Line.__table__()
+        cursor = Transaction().connection.cursor()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            expense, = Account.search([
+                    ('kind', '=', 'expense'),
+                    ])
+
+            move, = Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': revenue.id,
+                                        'credit': Decimal(100),
+                                        }, {
+                                        'account': expense.id,
+                                        'debit': Decimal(100),
+                                        }]),
+                            ],
+                        }])
+
+            def states():
+                return {l.state for l in Line.search([
+                            ('move', '=', move.id),
+                            ])}
+
+            self.assertEqual(states(), {'valid'})
+
+            line, = [l for l in move.lines if l.debit]
+            Line.write([line], {'debit': Decimal(90)})
+            self.assertEqual(states(), {'draft'})
+
+            Line.write([line], {'debit': Decimal(100)})
+            Move.flush_validate_move()
+            cursor.execute(*line_table.select(line_table.state,
+                    where=line_table.move == move.id))
+            self.assertEqual({s for s, in cursor.fetchall()}, {'valid'})
+
+    @with_transaction()
+    def test_journal_period_states(self):
+        "Test journal - period states of move lines"
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        JournalPeriod = pool.get('account.journal.period')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            expense, = Account.search([
+                    ('kind', '=', 'expense'),
+                    ])
+            key = (journal_revenue.id, period.id)
+
+            states = JournalPeriod.get_states([key])
+            journal_period, = JournalPeriod.search([
+                    ('journal', '=', journal_revenue.id),
+                    ('period', '=', period.id),
+                    ])
+            self.assertEqual(states, {key: (journal_period.id, 'open')})
+            self.assertEqual(JournalPeriod.get_states([key]), states)
+
+            JournalPeriod.close([journal_period])
+            self.assertEqual(JournalPeriod.get_states([key]),
+                {key: (journal_period.id, 'close')})
+
+            with self.assertRaises(UserError):
+                Move.create([{
+                            'period': period.id,
+                            'journal': journal_revenue.id,
+                            'date': period.start_date,
+                            'lines': [
+                                ('create', [{
+                                            'account': revenue.id,
+                                            'credit': Decimal(100),
+                                            }, {
+                                            'account': expense.id,
+                                            'debit': Decimal(100),
+                                            }]),
+                                ],
+                            }])
+
+    @with_transaction()
+    def test_journal_debit_credit(self):
+        "Test journal debit, credit and balance"
         pool = Pool()
         Party = pool.get('party.party')
         FiscalYear = pool.get('account.fiscalyear')
         Journal = pool.get('account.journal')
         Account = pool.get('account.account')
         Move = pool.get('account.move')
-        Line = pool.get('account.move.line')
-        Period = pool.get('account.period')
 
         party = Party(name='Party')
         party.save()
@@ -435,62 +1549,161 @@ class AccountTestCase(ModuleTestCase):
             journal_revenue, = Journal.search([
                     ('code', '=', 'REV'),
                     ])
+            journal_expense, = Journal.search([
+                    ('code', '=', 'EXP'),
+                    ])
             revenue, = Account.search([
                     ('kind', '=', 'revenue'),
                     ])
             receivable, = Account.search([
                     ('kind', '=', 'receivable'),
                     ])
+            expense, = Account.search([
+                    ('kind', '=', 'expense'),
+                    ])
+            payable, = Account.search([
+                    ('kind', '=', 'payable'),
+                    ])
+            journal_revenue.debit_account = receivable
+            journal_revenue.save()
+            journal_expense.credit_account = payable
+            journal_expense.save()
+
+            Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': revenue.id,
+                                        'credit': Decimal(100),
+                                        }, {
+                                        'account': receivable.id,
+                                        'debit': Decimal(100),
+                                        'party': party.id,
+                                        }]),
+                            ],
+                        }, {
+                        'period': period.id,
+                        'journal': journal_expense.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': expense.id,
+                                        'debit': Decimal(30),
+                                        }, {
+                                        'account': payable.id,
+                                        'credit': Decimal(30),
+                                        'party': party.id,
+                                        }]),
+                            ],
+                        }])
 
-            move = Move()
-            move.period = period
-            move.journal = journal_revenue
-            move.date = period.start_date
-            move.lines = [
-                Line(account=revenue, credit=Decimal(100)),
-                Line(account=receivable, debit=Decimal(100), party=party),
-                ]
-            move.save()
-            Move.post([move])
-            move_id = move.id
-
-            self.assertEqual(move.state, 'posted')
+            with Transaction().set_context(
+                    start_date=period.start_date,
+                    end_date=period.end_date):
+                journal_revenue = Journal(journal_revenue.id)
+                journal_expense = Journal(journal_expense.id)
+                self.assertEqual(
+                    (journal_revenue.debit, journal_revenue.credit,
+                        journal_revenue.balance),
+                    (Decimal(100), Decimal(0), Decimal(100)))
+                self.assertEqual(
+                    (journal_expense.debit, journal_expense.credit,
+                        journal_expense.balance),
+                    (Decimal(0), Decimal(30), Decimal(-30)))
 
-            # Can not post an empty move
-            with self.assertRaises(UserError):
-                move = Move()
-                move.period = period
-                move.journal = journal_revenue
-                move.date = period.start_date
-                move.save()
-                Move.post([move])
-            Move.delete([move])
+            with Transaction().set_context(
+                    start_date=period.end_date + datetime.timedelta(days=1),
+                    end_date=period.end_date + datetime.timedelta(days=1)):
+                journal_revenue = Journal(journal_revenue.id)
+                self.assertEqual(journal_revenue.balance, Decimal(0))
 
-            # Can not modify posted move
-            with self.assertRaises(UserError):
-                move = Move(move_id)
-                move.date = period.end_date
-                move.save()
+    @with_transaction()
+    def test_journal_daily_total(self):
+        "Test journal daily total built from lines when the option is set"
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        DailyTotal = pool.get('account.journal.daily_total')
 
-            # Can not go back to draft
-            with self.assertRaises(UserError):
-                move = Move(move_id)
-                move.state = 'draft'
-                move.save()
+        if not config.has_section('account'):
+            config.add_section('account')
+        self.addCleanup(config.remove_option, 'account',
+            'journal_daily_total')
 
-            Period.close([period])
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
 
-            # Can not create move with lines on closed period
-            with self.assertRaises(UserError):
-                move = Move()
-                move.period = period
-                move.journal = journal_revenue
-                move.date = period.start_date
-                move.lines = [
-                    Line(account=revenue, credit=Decimal(100)),
-                    Line(account=receivable, debit=Decimal(100), party=party),
-                    ]
-                move.save()
+            journal, = Journal.search([
+                    ('code', '=', 'EXP'),
+                    ])
+            expense, = Account.search([
+                    ('kind', '=', 'expense'),
+                    ])
+            cash, = Account.search([
+                    ('kind', '=', 'other'),
+                    ('name', '=', 'Main Cash'),
+                    ])
+            journal.credit_account = cash
+            journal.save()
+
+            def create_move(amount):
+                Move.create([{
+                            'period': period.id,
+                            'journal': journal.id,
+                            'date': period.start_date,
+                            'lines': [
+                                ('create', [{
+                                            'account': expense.id,
+                                            'debit': amount,
+                                            }, {
+                                            'account': cash.id,
+                                            'credit': amount,
+                                            }]),
+                                ],
+                            }])
+
+            def credit():
+                with Transaction().set_context(
+                        start_date=period.start_date,
+                        end_date=period.end_date):
+                    return Journal(journal.id).credit
+
+            def total():
+                total, = DailyTotal.search([
+                        ('account', '=', cash.id),
+                        ])
+                return total.credit
+
+            config.set('account', 'journal_daily_total', 'True')
+            create_move(Decimal(100))
+            self.assertTrue(DailyTotal.built())
+            self.assertEqual(total(), Decimal(100))
+
+            # Not maintained without the option
+            config.set('account', 'journal_daily_total', 'False')
+            create_move(Decimal(50))
+            self.assertFalse(DailyTotal.built())
+            self.assertEqual(DailyTotal.search([], count=True), 0)
+            self.assertEqual(credit(), Decimal(150))
+
+            # Computed from the lines until the next change
+            config.set('account', 'journal_daily_total', 'True')
+            self.assertFalse(DailyTotal.built())
+            self.assertEqual(credit(), Decimal(150))
+
+            create_move(Decimal(20))
+            self.assertTrue(DailyTotal.built())
+            self.assertEqual(total(), Decimal(170))
+            self.assertEqual(credit(), Decimal(170))
 
     @with_transaction()
     def test_tax_compute(self):
@@ -882,6 +2095,127 @@ class AccountTestCase(ModuleTestCase):
                     [vat0, ecotax1, vat1, ecotax3, vat2]),
                 Decimal(100))
 
+    @with_transaction()
+    def test_line_open_item(self):
+        "Test open items refreshed by posting and account kind"
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        OpenItem = pool.get('account.move.line.open_item')
+
+        party = Party(name='Party')
+        party.save()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+
+            def amounts():
+                return sorted(i.amount for i in OpenItem.search([
+                            ('party', '=', party.id),
+                            ]))
+
+            moves = Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': revenue.id,
+                                        'credit': amount,
+                                        }, {
+                                        'account': receivable.id,
+                                        'debit': amount,
+                                        'party': party.id,
+                                        }]),
+                            ],
+                        } for amount in [Decimal(100), Decimal(50)]])
+            Move.post(moves)
+            self.assertEqual(amounts(), [Decimal(50), Decimal(100)])
+
+            Account.write([receivable], {'kind': 'other'})
+            self.assertEqual(amounts(), [])
+
+            Account.write([receivable], {'kind': 'receivable'})
+            self.assertEqual(amounts(), [Decimal(50), Decimal(100)])
+
+    @with_transaction()
+    def test_line_read_validate_move(self):
+        "Test the moves are validated before reading lines"
+        pool = Pool()
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+        Line = pool.get('account.move.line')
+        line = Line.__table__()
+        cursor = Transaction().connection.cursor()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            expense, = Account.search([
+                    ('kind', '=', 'expense'),
+                    ])
+
+            move, = Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': revenue.id,
+                                        'credit': Decimal(100),
+                                        }, {
+                                        'account': expense.id,
+                                        'debit': Decimal(100),
+                                        }]),
+                            ],
+                        }])
+            line_ids = [l.id for l in move.lines]
+            Move.flush_validate_move()
+
+            def states():
+                cursor.execute(*line.select(line.state,
+                        where=line.id.in_(line_ids)))
+                return {s for s, in cursor.fetchall()}
+            self.assertEqual(states(), {'valid'})
+
+            cursor.execute(*line.update([line.state], ['draft'],
+                    where=line.id.in_(line_ids)))
+            Move.queue_validate_move([move])
+            for values in Line.read(line_ids, ['debit', 'credit']):
+                self.assertNotIn('state', values)
+            self.assertEqual(states(), {'valid'})
+
     @with_transaction()
     def test_receivable_payable(self):
         'Test party receivable payable'
@@ -976,11 +2310,269 @@ class AccountTestCase(ModuleTestCase):
                     self.assertEqual(
                         Party.search([(field, 'not in', [value])]),
                         [], msg=msg)
+                self.assertEqual(
+                    Party.search([], order=[('receivable', 'DESC')])[0],
+                    party_test)
+                self.assertEqual(
+                    Party.search([], order=[('payable', 'DESC')])[0],
+                    party_test)
 
             check_fields()
             close_fiscalyear(fiscalyear)
             check_fields()
 
+    @with_transaction()
+    def test_receivable_payable_today(self):
+        'Test party receivable payable today and rounding'
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+
+        company = create_company()
+        with set_company(company):
+            create_chart(company)
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+            expense, = Account.search([
+                    ('kind', '=', 'expense'),
+                    ])
+            payable, = Account.search([
+                    ('kind', '=', 'payable'),
+                    ])
+            party, other = Party.create([{
+                        'name': 'Party',
+                        }, {
+                        'name': 'Other',
+                        }])
+            today = datetime.date.today()
+            yesterday = today - datetime.timedelta(days=1)
+            tomorrow = today + datetime.timedelta(days=1)
+
+            lines = []
+            for account, counterpart, amount, party_, maturity_date in [
+                    (receivable, revenue, Decimal('10.10'), party, today),
+                    (receivable, revenue, Decimal('20.20'), party, None),
+                    (receivable, revenue, Decimal('0.07'), party, tomorrow),
+                    (payable, expense, Decimal('0.10'), party, yesterday),
+                    (payable, expense, Decimal('0.20'), party, tomorrow),
+                    (receivable, revenue, Decimal('5'), other, yesterday),
+                    ]:
+                lines.extend([{
+                            'account': counterpart.id,
+                            'credit': amount,
+                            }, {
+                            'account': account.id,
+                            'debit': amount,
+                            'party': party_.id,
+                            'maturity_date': maturity_date,
+                            }])
+            move, = Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [('create', lines)],
+                        }])
+            Move.post([move])
+
+            names = ['receivable', 'receivable_today',
+                'payable', 'payable_today']
+            result = Party.get_receivable_payable([party, other], names)
+            self.assertEqual(result, {
+                    'receivable': {
+                        party.id: Decimal('30.37'),
+                        other.id: Decimal('5'),
+                        },
+                    'receivable_today': {
+                        party.id: Decimal('30.30'),
+                        other.id: Decimal('5'),
+                        },
+                    'payable': {
+                        party.id: Decimal('0.30'),
+                        other.id: Decimal('0'),
+                        },
+                    'payable_today': {
+                        party.id: Decimal('0.10'),
+                        other.id: Decimal('0'),
+                        },
+                    })
+
+    @with_transaction()
+    def test_receivable_payable_delete(self):
+        'Test party receivable payable after deleting moves'
+        pool = Pool()
+        Party = pool.get('party.party')
+        PartyBalance = pool.get('party.party.balance')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        Move = pool.get('account.move')
+
+        company = create_company()
+        with set_company(company):
+            create_chart(company)
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+            party = Party(name='Party')
+            party.save()
+
+            moves = Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [('create', [{
+                                        'account': revenue.id,
+                                        'credit': Decimal(100),
+                                        }, {
+                                        'account': receivable.id,
+                                        'debit': Decimal(100),
+                                        'party': party.id,
+                                        }])],
+                        }] * 2)
+            self.assertEqual(Party(party.id).receivable, Decimal(200))
+
+            def get_balances():
+                return [(b.kind, b.balance) for b in PartyBalance.search([
+                            ('party', '=', party.id),
+                            ])]
+
+            Move.delete(moves[:1])
+            self.assertEqual(Party(party.id).receivable, Decimal(100))
+            self.assertEqual(get_balances(), [('receivable', Decimal(100))])
+            self.assertEqual(
+                Party.search([('receivable', '>', 0)]), [party])
+
+            Move.delete(moves[1:])
+            self.assertEqual(Party(party.id).receivable, Decimal(0))
+            self.assertEqual(get_balances(), [])
+            self.assertEqual(Party.search([('receivable', '>', 0)]), [])
+
+    @with_transaction()
+    def test_tax_code_sum(self):
+        'Test tax code sum'
+        pool = Pool()
+        Party = pool.get('party.party')
+        FiscalYear = pool.get('account.fiscalyear')
+        Journal = pool.get('account.journal')
+        Account = pool.get('account.account')
+        TaxCode = pool.get('account.tax.code')
+        Move = pool.get('account.move')
+
+        party = Party(name='Party')
+        party.save()
+
+        company = create_company()
+        with set_company(company):
+            fiscalyear = get_fiscalyear(company)
+            fiscalyear.save()
+            FiscalYear.create_period([fiscalyear])
+            period = fiscalyear.periods[0]
+            create_chart(company, tax=True)
+
+            journal_revenue, = Journal.search([
+                    ('code', '=', 'REV'),
+                    ])
+            revenue, = Account.search([
+                    ('kind', '=', 'revenue'),
+                    ])
+            receivable, = Account.search([
+                    ('kind', '=', 'receivable'),
+                    ])
+            tax_code, = TaxCode.search([
+                    ('name', '=', 'Tax Code'),
+                    ])
+            base_code, = TaxCode.search([
+                    ('name', '=', 'Base Code'),
+                    ])
+            total, inactive = TaxCode.create([{
+                        'name': 'Total',
+                        'childs': [('add', [tax_code.id])],
+                        }, {
+                        'name': 'Inactive',
+                        'parent': tax_code.id,
+                        'active': False,
+                        'childs': [('add', [base_code.id])],
+                        }])
+
+            Move.create([{
+                        'period': period.id,
+                        'journal': journal_revenue.id,
+                        'date': period.start_date,
+                        'lines': [
+                            ('create', [{
+                                        'account': revenue.id,
+                                        'credit': Decimal(100),
+                                        'tax_lines': [('create', [{
+                                                        'code': base_code.id,
+                                                        'amount': Decimal(100),
+                                                        }, {
+                                                        'code': tax_code.id,
+                                                        'amount': Decimal(20),
+                                                        }])],
+                                        }, {
+                                        'account': receivable.id,
+                                        'debit': Decimal(100),
+                                        'party': party.id,
+                                        }]),
+                            ],
+                        }])
+
+            self.assertEqual(TaxCode.get_sum(
+                    [total, tax_code, base_code], 'sum'), {
+                    total.id: Decimal(20),
+                    tax_code.id: Decimal(20),
+                    base_code.id: Decimal(100),
+                    })
+
+            TaxCode.write([inactive], {'active': True})
+            self.assertEqual(TaxCode.get_sum([total], 'sum'), {
+                    total.id: Decimal(120),
+                    })
+
+    def test_zero_sum_matcher(self):
+        'Test ZeroSumMatcher'
+        for items, required, result in [
+                ([(1, 100), (2, -100), (3, 50)], None, [1, 2]),
+                ([(1, 100), (2, -60), (3, -40), (4, 7)], None, [1, 2, 3]),
+                ([(1, 10), (2, -10), (3, 30), (4, -30)], {3}, [1, 2, 3, 4]),
+                ([(1, 10), (2, -10), (3, 30), (4, -20)], {3}, [2, 3, 4]),
+                ([(1, 10), (2, -10), (3, 30), (4, -25)], {4}, []),
+                ([(1, 10), (2, -10), (3, 30), (4, -25)], None, [1, 2]),
+                ([(1, 5), (2, 3), (3, -2), (4, -6), (5, 4), (6, -1)], None,
+                    [1, 3, 4, 5, 6]),
+                ]:
+            matcher = ZeroSumMatcher(items, required=required)
+            self.assertEqual(sorted(matcher.match()), result)
+
+        items = [(i, (-1) ** i * (i // 2 + 1)) for i in range(40)]
+        items.append((40, 1))
+        matcher = ZeroSumMatcher(items, timeout=5)
+        self.assertEqual(len(matcher.match()), 40)
+
     @with_transaction()
     def test_sort_taxes(self):
         "Test sort_taxes"